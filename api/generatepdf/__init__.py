@@ -1,49 +1,150 @@
 import logging
 import azure.functions as func
-import requests
+import aiohttp
 import os
 import json
+import sys
+import threading
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
-def main(req: func.HttpRequest) -> func.HttpResponse:
+# One connection pool per worker, created on the worker's event loop on first use
+_session = None
+
+# Passed through untouched in each direction, so compressed bodies are never re-encoded here
+FORWARDED_REQUEST_HEADERS = ('Authorization', 'Content-Encoding', 'Accept-Encoding', 'If-None-Match', 'X-Request-ID')
+FORWARDED_RESPONSE_HEADERS = (
+    'Content-Encoding', 'Content-Length', 'ETag', 'Cache-Control', 'Vary', 'X-Packet-Pages'
+)
+
+# With PDF_FUNCTION_DIR pointing at a co-located copy of pdf-function, packets are
+# rendered in this worker instead of over HTTP; False once loading it has failed
+_renderer = None
+_renderer_lock = threading.Lock()
+
+def get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        timeout = aiohttp.ClientTimeout(total=float(os.environ.get('PDF_FUNCTION_TIMEOUT_SECONDS', '120')))
+        # Keep upstream responses encoded; the client negotiated the encoding through us
+        _session = aiohttp.ClientSession(timeout=timeout, auto_decompress=False)
+    return _session
+
+def get_renderer():
+    """The co-located pdf-function app, or None to forward over HTTP"""
+    global _renderer
+    renderer_dir = os.environ.get('PDF_FUNCTION_DIR')
+    if not renderer_dir or _renderer is False:
+        return None
+    if _renderer is None:
+        with _renderer_lock:
+            if _renderer is None:
+                try:
+                    if renderer_dir not in sys.path:
+                        sys.path.append(renderer_dir)
+                    import function_app
+                    _renderer = function_app
+                    logging.info(f'Rendering PDFs in-process from {renderer_dir}')
+                except Exception as e:
+                    # e.g. the renderer's requirements are not installed with this app
+                    _renderer = False
+                    logging.warning(f'Could not load the renderer from {renderer_dir}, forwarding over HTTP: {str(e)}')
+                    return None
+    return _renderer
+
+def upstream_url(pdf_function_url, params):
+    """pdf_function_url with the client's query parameters (documents, pages, ...) appended.
+
+    Parameters already in pdf_function_url, such as its function key, are not
+    overridden by the client's.
+    """
+    url = urlsplit(pdf_function_url)
+    query = parse_qsl(url.query)
+    configured = {name for name, _ in query}
+    query.extend((name, value) for name, value in params.items() if name not in configured)
+    return urlunsplit(url._replace(query=urlencode(query)))
+
+def proxy_response(status_code, upstream_headers, body):
+    """The response for the client, with the same headers whichever way the packet was rendered"""
+    # A 304 for an If-None-Match the client sent has no body to describe
+    if status_code == 304:
+        response_headers = {}
+        content_type = ''
+    else:
+        content_type = upstream_headers.get('Content-Type', 'application/pdf')
+        response_headers = {'Content-Type': content_type}
+    # JSON bodies (errors, or a download URL under delivery=url) are not attachments
+    if content_type.startswith('application/pdf'):
+        response_headers['Content-Disposition'] = upstream_headers.get(
+            'Content-Disposition', 'attachment; filename=document.pdf'
+        )
+    for name in FORWARDED_RESPONSE_HEADERS:
+        if name in upstream_headers:
+            response_headers[name] = upstream_headers[name]
+
+    # Return the response from the PDF generation function
+    return func.HttpResponse(
+        body=body,
+        status_code=status_code,
+        headers=response_headers
+    )
+
+async def render_in_process(renderer, request_body, pdf_function_url, headers):
+    """Call the generatePDF handler directly with the request it would have received over HTTP.
+
+    It sees the same headers, body and URL as the HTTP hop would give it, so
+    download URLs under delivery=url still point at the function app; for
+    those to resolve, ARTIFACT_DIR must be storage both apps share.
+    """
+    url = urlsplit(pdf_function_url)
+    upstream_req = func.HttpRequest(
+        method='POST',
+        url=pdf_function_url,
+        headers=headers,
+        params=dict(parse_qsl(url.query)),
+        body=request_body
+    )
+    response = await renderer.handle_generate_pdf(upstream_req)
+    # Error responses only set a mimetype, which the host turns into Content-Type
+    if 'Content-Type' not in response.headers and response.mimetype:
+        response.headers['Content-Type'] = response.mimetype
+    return proxy_response(response.status_code, response.headers, response.get_body())
+
+async def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
 
     # Get the PDF function URL from environment variable or use a default
     pdf_function_url = os.environ.get('PDF_FUNCTION_URL', 'https://jhonboard-func.azurewebsites.net/api/generatepdf')
-    
+
     try:
         # Forward the request body to the PDF generation function
         request_body = req.get_body()
         headers = {
             'Content-Type': 'application/json'
         }
-        
-        # Forward any authorization headers
-        if req.headers.get('Authorization'):
-            headers['Authorization'] = req.headers.get('Authorization')
-            
+
+        # Forward authorization and content negotiation headers
+        for name in FORWARDED_REQUEST_HEADERS:
+            if req.headers.get(name):
+                headers[name] = req.headers.get(name)
+        # Otherwise aiohttp would ask for gzip on behalf of a client that can't decode it
+        headers.setdefault('Accept-Encoding', 'identity')
+
+        pdf_function_url = upstream_url(pdf_function_url, req.params)
+        renderer = get_renderer()
+        if renderer is not None:
+            return await render_in_process(renderer, request_body, pdf_function_url, headers)
+
         # Log request being forwarded
         logging.info(f'Forwarding request to {pdf_function_url}')
-        
-        # Make the request to the PDF generation function
-        response = requests.post(
-            pdf_function_url,
-            data=request_body,
-            headers=headers
-        )
-        
-        # Return the response from the PDF generation function
-        return func.HttpResponse(
-            body=response.content,
-            status_code=response.status_code,
-            headers={
-                'Content-Type': response.headers.get('Content-Type', 'application/pdf'),
-                'Content-Disposition': response.headers.get('Content-Disposition', 'attachment; filename=document.pdf')
-            }
-        )
+
+        # Wait for the PDF generation function without holding up the worker
+        async with get_session().post(pdf_function_url, data=request_body, headers=headers) as response:
+            content = await response.read()
+            return proxy_response(response.status, response.headers, content)
     except Exception as e:
         logging.error(f'Error forwarding request: {str(e)}')
         return func.HttpResponse(
             body=json.dumps({"error": str(e)}),
             status_code=500,
             headers={'Content-Type': 'application/json'}
-        ) 
\ No newline at end of file
+        )
\ No newline at end of file
@@ -320,6 +320,7 @@ CREATE TABLE IF NOT EXISTS signatures (
 CREATE INDEX IF NOT EXISTS idx_participants_email ON participants(email);
 CREATE INDEX IF NOT EXISTS idx_participants_name ON participants(first_name, last_name);
 CREATE INDEX IF NOT EXISTS idx_participants_created_at ON participants(created_at);
+CREATE INDEX IF NOT EXISTS idx_participants_updated_at ON participants(updated_at);
 
 -- Foreign key indexes for all tables
 CREATE INDEX IF NOT EXISTS idx_health_status_participant ON health_status(participant_id);
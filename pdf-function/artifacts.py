@@ -0,0 +1,94 @@
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+from urllib.parse import quote, urlencode
+
+# Lifetime of a download URL, and how long stored packets are kept for URLs still in flight
+ARTIFACT_URL_TTL_SECONDS = int(os.environ.get('ARTIFACT_URL_TTL_SECONDS', '300'))
+ARTIFACT_RETENTION_SECONDS = int(os.environ.get('ARTIFACT_RETENTION_SECONDS', '3600'))
+ARTIFACT_SWEEP_INTERVAL_SECONDS = 60
+
+class LocalArtifactStore:
+    """Content-addressed packet store on the local filesystem (or a mounted file share).
+
+    Packets are stored under the SHA-256 of their bytes, so the same packet is
+    written once however often it is requested. Files older than the retention
+    period are swept on the next write after each sweep interval.
+    """
+
+    def __init__(self, directory, retention_seconds=ARTIFACT_RETENTION_SECONDS):
+        self.directory = directory
+        self.retention_seconds = retention_seconds
+        self._swept_at = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pdf")
+
+    def put(self, data):
+        """Store data and return its key"""
+        key = hashlib.sha256(data).hexdigest()
+        path = self._path(key)
+        if os.path.exists(path):
+            # Restart the retention period for a packet that is still being requested
+            os.utime(path)
+        else:
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as file:
+                file.write(data)
+            os.replace(temp_path, path)
+        self._maybe_sweep()
+        return key
+
+    def get(self, key):
+        """Return the stored bytes for key, or None when unknown or already swept"""
+        if len(key) != 64 or not all(c in '0123456789abcdef' for c in key):
+            return None
+        try:
+            with open(self._path(key), 'rb') as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def _maybe_sweep(self):
+        now = time.time()
+        if now - self._swept_at < ARTIFACT_SWEEP_INTERVAL_SECONDS:
+            return
+        with self._lock:
+            if now - self._swept_at < ARTIFACT_SWEEP_INTERVAL_SECONDS:
+                return
+            self._swept_at = now
+            removed = 0
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.pdf') and now - entry.stat().st_mtime > self.retention_seconds:
+                    try:
+                        os.remove(entry.path)
+                        removed += 1
+                    except FileNotFoundError:
+                        pass
+            if removed:
+                logging.info(f"Removed {removed} expired artifacts")
+
+def _signature(secret, key, expires, filename):
+    message = f"{key}:{expires}:{filename}".encode('utf-8')
+    return hmac.new(secret.encode('utf-8'), message, hashlib.sha256).hexdigest()
+
+def signed_url(base_url, secret, key, filename, ttl_seconds=ARTIFACT_URL_TTL_SECONDS):
+    """Build an expiring download URL for a stored artifact; returns (url, expires)"""
+    expires = int(time.time()) + ttl_seconds
+    query = urlencode({'expires': expires, 'filename': filename, 'sig': _signature(secret, key, expires, filename)})
+    return f"{base_url.rstrip('/')}/api/artifacts/{quote(key)}?{query}", expires
+
+def verify_signature(secret, key, expires, filename, signature):
+    """True when the URL parameters were signed with secret and have not expired"""
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return False
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(_signature(secret, key, expires, filename), signature or '')
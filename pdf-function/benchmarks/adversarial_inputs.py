@@ -0,0 +1,146 @@
+"""Send oversized and pathological payloads to generatePDF and check the limits hold.
+
+Run from the pdf-function directory:
+
+    python benchmarks/adversarial_inputs.py
+
+Each case goes through the generatePDF handler and must come back with the
+expected status code: payloads over the limits in limits.py are rejected
+up front within REJECT_SECONDS, the worst payload inside the limits renders
+within MAX_RENDER_SECONDS, and a render that runs past its budget is
+abandoned with a 422. A request that reuses another's signatureId must get
+only the signature image it sent. Exits non-zero if any case fails.
+"""
+import asyncio
+import copy
+import gzip
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import azure.functions as func
+
+import function_app
+from concurrency_stress import signature_data_url
+from function_app import WARMUP_PAYLOAD
+from signatures import decode_signature_image, resolve_signature_images
+from limits import (
+    LIST_LIMITS, MAX_LIST_ITEMS, MAX_RENDER_SECONDS, MAX_REQUEST_BYTES, MAX_STRING_LENGTH, STRING_LIMITS
+)
+
+# Rejections must not cost more than parsing the body
+REJECT_SECONDS = 1.0
+
+
+def payload(**overrides):
+    body = copy.deepcopy(WARMUP_PAYLOAD)
+    body['firstName'] = f"Adversarial{time.perf_counter_ns()}"
+    body.update(overrides)
+    return body
+
+
+def request(body, headers=None):
+    if not isinstance(body, bytes):
+        body = json.dumps(body).encode('utf-8')
+    return func.HttpRequest('POST', '/api/generatepdf', body=body, headers=headers or {})
+
+
+def worst_case_within_limits():
+    """Every list at its limit, every string at its limit and without spaces to break lines on"""
+    def text(field, fill='W'):
+        limit = STRING_LIMITS.get(field, MAX_STRING_LENGTH)
+        return (fill * limit)[:limit]
+
+    image = signature_data_url(7)
+    return payload(
+        medications=[{'name': text('name'), 'notes': text('notes')} for _ in range(LIST_LIMITS['medications'])],
+        pendingCharges=[
+            {'chargeDescription': text('chargeDescription'), 'location': text('location')}
+            for _ in range(LIST_LIMITS['pendingCharges'])
+        ],
+        convictions=[{'offense': text('offense')} for _ in range(LIST_LIMITS['convictions'])],
+        authorizedPeople=[
+            {'firstName': text('firstName'), 'lastName': text('lastName'), 'relationship': text('relationship'),
+             'phone': text('phone')}
+            for _ in range(LIST_LIMITS['authorizedPeople'])
+        ],
+        legalStatus={'hasPendingCharges': True, 'hasConvictions': True, 'isOnBond': True,
+                     'bondsmanName': text('bondsmanName'), 'additionalInformation': text('additionalInformation', 'W\n')},
+        signatures=[
+            {'signatureType': t, 'signatureId': 'adversarial', 'signature': image,
+             'signatureTimestamp': '2024-01-01T00:00:00Z'}
+            for t in WARMUP_PAYLOAD['documentTypes']
+        ],
+    )
+
+
+def cases():
+    yield 'body over MAX_REQUEST_BYTES', request(b' ' * (MAX_REQUEST_BYTES + 1)), 413, REJECT_SECONDS
+    yield 'gzip bomb', request(gzip.compress(b' ' * (MAX_REQUEST_BYTES * 50)), {'Content-Encoding': 'gzip'}), 413, REJECT_SECONDS
+    yield 'too many medications', request(payload(medications=[{'name': 'M'}] * 100_000)), 422, REJECT_SECONDS
+    yield 'too many convictions', request(payload(convictions=[{'offense': 'O'}] * 10_000)), 422, REJECT_SECONDS
+    yield 'huge free text', request(payload(legalStatus={'additionalInformation': 'x' * 1_000_000})), 422, REJECT_SECONDS
+    yield 'huge witness signature', request(payload(signatures=[
+        {'signatureType': 'intake_form', 'witnessSignature': 'data:image/png;base64,' + 'A' * STRING_LIMITS['witnessSignature']}
+    ])), 422, REJECT_SECONDS
+    yield 'huge name', request(payload(firstName='N' * 100_000)), 422, REJECT_SECONDS
+    yield 'unlisted list field', request(payload(drugHistory=[{}] * (MAX_LIST_ITEMS + 1))), 422, REJECT_SECONDS
+    yield 'deep nesting', request(b'[' * 100_000 + b']' * 100_000), 422, REJECT_SECONDS
+    yield 'nesting past MAX_NESTING_DEPTH', request(payload(vehicle=json.loads('{"a":' * 50 + '1' + '}' * 50))), 422, REJECT_SECONDS
+    yield 'documentTypes as a string', request(payload(documentTypes='intake_form')), 422, REJECT_SECONDS
+    yield 'worst case within limits', request(worst_case_within_limits()), 200, MAX_RENDER_SECONDS
+
+
+async def run_case(name, req, expected_status, max_seconds):
+    started = time.perf_counter()
+    response = await function_app.generate_pdf._function._func(req)
+    elapsed = time.perf_counter() - started
+    ok = response.status_code == expected_status and elapsed <= max_seconds
+    print(f"{'ok  ' if ok else 'FAIL'} {name:<36} {response.status_code} (expected {expected_status}) in {elapsed:.3f}s")
+    return ok
+
+
+def signature_id_cases():
+    """signatureId is chosen by the client, so it must never select a cached image"""
+    image, other_image = signature_data_url(1), signature_data_url(2)
+    resolve_signature_images([{'signatureType': 'intake_form', 'signatureId': 'shared', 'signature': image}])
+    cases = [
+        ('signatureId reused with another image', other_image, decode_signature_image(other_image)),
+        ('signatureId reused without an image', None, None),
+    ]
+    results = []
+    for name, value, expected in cases:
+        sig = {'signatureType': 'intake_form', 'signatureId': 'shared'}
+        if value:
+            sig['signature'] = value
+        reader = resolve_signature_images([sig]).get('intake_form')
+        ok = (reader.raw if reader else None) == expected
+        print(f"{'ok  ' if ok else 'FAIL'} {name:<36} {'image' if reader else 'no image'}")
+        results.append(ok)
+    return results
+
+
+async def main():
+    results = [await run_case(*case) for case in cases()]
+    results.extend(signature_id_cases())
+
+    # With a tiny budget the worst case must be abandoned rather than rendered
+    budget = 0.05
+    function_app.MAX_RENDER_SECONDS = budget
+    try:
+        results.append(await run_case(
+            f'render budget of {budget}s', request(worst_case_within_limits()), 422, budget + REJECT_SECONDS
+        ))
+    finally:
+        function_app.MAX_RENDER_SECONDS = MAX_RENDER_SECONDS
+
+    failures = results.count(False)
+    print(f"{len(results) - failures}/{len(results)} cases passed")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,74 @@
+"""Measure bytes saved and CPU cost of compressed transport per packet size.
+
+Run from the pdf-function directory:
+
+    python benchmarks/compression.py
+
+For a range of payload sizes, renders the packet and reports, for both the
+JSON request body and the PDF response, the size and encode/decode time of
+every encoding generatePDF negotiates at the configured levels.
+"""
+import copy
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compression import RESPONSE_ENCODINGS, decode_body, encode_body
+from concurrency_stress import GENERATED_AT, signature_data_url
+from function_app import WARMUP_PAYLOAD
+from renderer import build_pdf, resolve_document_types
+
+# (label, medications, signatures with images)
+PACKET_SIZES = [
+    ('minimal', 0, False),
+    ('typical', 10, True),
+    ('long history', 200, True),
+    ('very long history', 1000, True),
+]
+REPEATS = 5
+
+
+def build_payload(medication_count, with_images):
+    payload = copy.deepcopy(WARMUP_PAYLOAD)
+    payload['medications'] = [{'name': f'Medication {i}', 'notes': 'Twice daily with food'} for i in range(medication_count)]
+    if with_images:
+        image = signature_data_url(medication_count)
+        payload['signatures'] = [
+            {'signatureType': t, 'signatureId': 'bench', 'signature': image, 'signatureTimestamp': '2024-01-01T00:00:00Z'}
+            for t in payload['documentTypes']
+        ]
+    return payload
+
+
+def measure(data, encoding):
+    started = time.perf_counter()
+    for _ in range(REPEATS):
+        encoded = encode_body(data, encoding)
+    encode_ms = (time.perf_counter() - started) / REPEATS * 1000
+    started = time.perf_counter()
+    for _ in range(REPEATS):
+        decode_body(encoded, encoding)
+    decode_ms = (time.perf_counter() - started) / REPEATS * 1000
+    return len(encoded), encode_ms, decode_ms
+
+
+def main():
+    print(f"{'packet':<18} {'body':<8} {'identity':>10} {'encoding':>8} {'bytes':>10} {'saved':>7} {'encode ms':>10} {'decode ms':>10}")
+    for label, medication_count, with_images in PACKET_SIZES:
+        payload = build_payload(medication_count, with_images)
+        request_body = json.dumps(payload).encode('utf-8')
+        pdf_bytes = build_pdf(payload, resolve_document_types(payload), GENERATED_AT)
+        for body_name, data in (('request', request_body), ('response', pdf_bytes)):
+            for encoding in RESPONSE_ENCODINGS:
+                size, encode_ms, decode_ms = measure(data, encoding)
+                saved = 1 - size / len(data)
+                print(f"{label:<18} {body_name:<8} {len(data):>10} {encoding:>8} {size:>10} {saved:>6.1%} "
+                      f"{encode_ms:>10.2f} {decode_ms:>10.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""Stress the renderer from a thread pool and check every result is byte-identical.
+
+Run from the pdf-function directory:
+
+    python benchmarks/concurrency_stress.py [--threads 16] [--renders 200]
+
+Each payload is rendered once sequentially as the reference, then rendered
+many times concurrently with a fixed generated_at in invariant mode. Exits
+non-zero if any concurrent render differs from its reference.
+"""
+import argparse
+import base64
+import copy
+import hashlib
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reportlab.graphics.shapes import Drawing, PolyLine
+from reportlab.graphics import renderPM
+
+from function_app import WARMUP_PAYLOAD
+from renderer import render_packet, resolve_document_types
+
+GENERATED_AT = datetime(2024, 1, 1, 12, 0, 0)
+
+
+def signature_data_url(seed):
+    drawing = Drawing(300, 80)
+    drawing.add(PolyLine([10, 40, 80, 70 - seed % 30, 160, 20 + seed % 40, 290, 50], strokeWidth=3))
+    png = BytesIO()
+    renderPM.drawToFile(drawing, png, fmt='PNG')
+    return 'data:image/png;base64,' + base64.b64encode(png.getvalue()).decode('ascii')
+
+
+def build_payloads():
+    payloads = []
+    for i in range(4):
+        payload = copy.deepcopy(WARMUP_PAYLOAD)
+        payload['firstName'] = f'Resident{i}'
+        payload['medications'] = [{'name': f'Medication {n}', 'notes': 'Daily'} for n in range(i * 40)]
+        image = signature_data_url(i)
+        payload['signatures'] = [
+            {'signatureType': t, 'signatureId': f'stress-{i}', 'signature': image, 'signatureTimestamp': '2024-01-01T00:00:00Z'}
+            for t in payload['documentTypes']
+        ]
+        payloads.append(payload)
+    return payloads
+
+
+def render(payload):
+    packet = render_packet(payload, resolve_document_types(payload), GENERATED_AT, invariant=True)
+    return hashlib.sha256(packet.pdf_bytes).hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--renders', type=int, default=200)
+    args = parser.parse_args()
+
+    payloads = build_payloads()
+    expected = [render(payload) for payload in payloads]
+
+    jobs = [i % len(payloads) for i in range(args.renders)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        results = list(pool.map(lambda i: (i, render(payloads[i])), jobs))
+    elapsed = time.perf_counter() - started
+
+    mismatches = sum(1 for i, digest in results if digest != expected[i])
+    print(f"{args.renders} renders on {args.threads} threads in {elapsed:.2f}s, {mismatches} mismatches")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
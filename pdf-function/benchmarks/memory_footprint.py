@@ -0,0 +1,153 @@
+"""Measure the memory a render costs per packet size and fail when it regresses.
+
+Run from the pdf-function directory:
+
+    python benchmarks/memory_footprint.py [--renders 20] [--sizes small medium large]
+
+Each packet size is measured in a fresh process, so one size's high-water
+mark cannot hide another's. After a warm-up render has loaded fonts,
+templates and styles, the process parses and renders the packet repeatedly,
+as a request would, and reports:
+
+  peak      how far the renders raised the process's peak RSS
+  steady    how much RSS stayed after the renders and a gc, i.e. what leaks
+  input     what the parsed request holds while it renders (tracemalloc)
+  render    the peak Python allocations of one render on top of its input
+
+input and render are what each in-flight request adds under concurrency,
+and the steadiest figures from run to run.
+
+Exits non-zero if any figure is over its budget in BUDGETS_MB.
+"""
+import argparse
+import base64
+import copy
+import gc
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tracemalloc
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from concurrency_stress import GENERATED_AT, signature_data_url
+
+FIGURES = ('peak', 'steady', 'input', 'render')
+# size -> budget in MB for each of FIGURES, with headroom over the figures measured when set
+BUDGETS_MB = {
+    'small': (4, 2, 0.5, 2),
+    'medium': (4, 2, 0.5, 2),
+    'large': (8, 4, 1, 4),
+}
+
+
+def large_signature_data_url(width=400, height=150):
+    """A PNG of noise, which does not compress, near the largest signature the limits accept"""
+    image = Image.frombytes('RGB', (width, height), random.Random(0).randbytes(width * height * 3))
+    png = BytesIO()
+    image.save(png, format='PNG')
+    return 'data:image/png;base64,' + base64.b64encode(png.getvalue()).decode('ascii')
+
+
+def build_payload(size):
+    """The packet for a size as the JSON body a client would send"""
+    from function_app import WARMUP_PAYLOAD
+    from limits import LIST_LIMITS
+
+    payload = copy.deepcopy(WARMUP_PAYLOAD)
+    if size == 'small':
+        return json.dumps(payload).encode('utf-8')
+    count = 20 if size == 'medium' else LIST_LIMITS['medications']
+    image = signature_data_url(count) if size == 'medium' else large_signature_data_url()
+    payload['medications'] = [{'name': f'Medication {n}', 'notes': 'Twice daily with food'} for n in range(count)]
+    payload['authorizedPeople'] = [
+        {'firstName': 'Authorized', 'lastName': f'Person {n}', 'relationship': 'friend', 'phone': '555-0101'}
+        for n in range(min(count, LIST_LIMITS['authorizedPeople']))
+    ]
+    payload['pendingCharges'] = [
+        {'chargeDescription': f'Charge {n}', 'location': 'County'} for n in range(min(count, LIST_LIMITS['pendingCharges']))
+    ]
+    payload['signatures'] = [
+        {'signatureType': t, 'signatureId': f'memory-{size}', 'signature': image, 'signatureTimestamp': '2024-01-01T00:00:00Z'}
+        for t in payload['documentTypes']
+    ]
+    return json.dumps(payload).encode('utf-8')
+
+
+def rss_kb():
+    """Current resident set size; Linux only, like the peak from getrusage"""
+    with open('/proc/self/statm') as file:
+        return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(size, renders):
+    """Runs in its own process: returns each of FIGURES in KB"""
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    from renderer import render_packet, resolve_document_types
+    from signatures import share_signature_images
+
+    body = build_payload(size)
+
+    def parse():
+        req_body = json.loads(body)
+        share_signature_images(req_body.get('signatures'))
+        return req_body
+
+    def render(req_body):
+        return render_packet(req_body, resolve_document_types(req_body), GENERATED_AT, invariant=True)
+
+    render(parse())
+    gc.collect()
+    baseline_rss = rss_kb()
+    baseline_peak = peak_rss_kb()
+
+    for _ in range(renders):
+        render(parse())
+    gc.collect()
+    peak = peak_rss_kb() - baseline_peak
+    steady = rss_kb() - baseline_rss
+
+    tracemalloc.start()
+    req_body = parse()
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    render(req_body)
+    render_peak = tracemalloc.get_traced_memory()[1] - held
+    tracemalloc.stop()
+    return peak, steady, held // 1024, render_peak // 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--renders', type=int, default=20)
+    parser.add_argument('--sizes', nargs='+', choices=list(BUDGETS_MB), default=list(BUDGETS_MB))
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    failures = 0
+    print(f"{'size':<8}" + ''.join(f"{name + ' MB':>11}" for name in FIGURES))
+    for size in args.sizes:
+        with context.Pool(1) as pool:
+            measured = pool.apply(measure, (size, args.renders))
+        figures = [kb / 1024 for kb in measured]
+        over = [name for name, figure, budget in zip(FIGURES, figures, BUDGETS_MB[size]) if figure > budget]
+        failures += bool(over)
+        status = f"FAIL ({', '.join(over)} over budget {BUDGETS_MB[size]})" if over else 'ok'
+        print(f"{size:<8}" + ''.join(f"{figure:>11.2f}" for figure in figures) + f"  {status}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
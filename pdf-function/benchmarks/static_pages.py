@@ -0,0 +1,84 @@
+"""Compare packets rendered with pre-rendered static agreement pages against full layout.
+
+Run from the pdf-function directory:
+
+    python benchmarks/static_pages.py
+
+Renders the full packet both ways and reports the best build time of each.
+Exits non-zero if the two differ in page count, page index or the text of
+any page, or if the pre-rendered pages are not at least MIN_SPEEDUP times
+faster.
+"""
+import copy
+import logging
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pypdf import PdfReader
+
+from concurrency_stress import GENERATED_AT, signature_data_url
+from renderer import DOCUMENT_TYPES, render_packet
+
+REPEATS = 20
+MIN_SPEEDUP = 1.3
+
+
+def build_payload():
+    from function_app import WARMUP_PAYLOAD
+
+    payload = copy.deepcopy(WARMUP_PAYLOAD)
+    image = signature_data_url(0)
+    payload['signatures'] = [
+        {'signatureType': t, 'signatureId': 'static-pages', 'signature': image, 'signatureTimestamp': '2024-01-01T00:00:00Z'}
+        for t in DOCUMENT_TYPES
+    ]
+    return payload
+
+
+def time_render(payload, static_pages):
+    best = None
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        packet = render_packet(payload, list(DOCUMENT_TYPES), GENERATED_AT, invariant=True, static_pages=static_pages)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, packet
+
+
+def page_texts(pdf_bytes):
+    return [page.extract_text() for page in PdfReader(BytesIO(pdf_bytes)).pages]
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    payload = build_payload()
+    # The first render pre-renders the static agreements
+    render_packet(payload, list(DOCUMENT_TYPES), GENERATED_AT, invariant=True, static_pages=True)
+
+    laid_out_time, laid_out = time_render(payload, False)
+    static_time, static = time_render(payload, True)
+    print(f"{'mode':<14} {'pages':>6} {'bytes':>8} {'build ms':>10}")
+    print(f"{'layout':<14} {laid_out.page_count:>6} {len(laid_out.pdf_bytes):>8} {laid_out_time * 1000:>10.2f}")
+    print(f"{'static pages':<14} {static.page_count:>6} {len(static.pdf_bytes):>8} {static_time * 1000:>10.2f}")
+
+    failures = []
+    if static.page_index != laid_out.page_index:
+        failures.append(f"page index differs: {static.page_index} != {laid_out.page_index}")
+    for number, (expected, actual) in enumerate(zip(page_texts(laid_out.pdf_bytes), page_texts(static.pdf_bytes)), 1):
+        if expected != actual:
+            failures.append(f"text of page {number} differs")
+    speedup = laid_out_time / static_time
+    print(f"speedup: {speedup:.2f}x")
+    if speedup < MIN_SPEEDUP:
+        failures.append(f"speedup below {MIN_SPEEDUP}x")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,58 @@
+"""Benchmark layout time of the shared history table builder.
+
+Run from the pdf-function directory:
+
+    python benchmarks/table_layout.py
+
+Builds a single-table document for each row count and reports the build time
+per row. Exits non-zero if the per-row cost at the largest size grows by more
+than MAX_PER_ROW_GROWTH over the smallest multi-page size, i.e. if layout stops
+scaling linearly.
+"""
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate
+
+from renderer import create_medication_table
+
+ROW_COUNTS = [4, 10, 100, 250, 500, 1000]
+REPEATS = 5
+MAX_PER_ROW_GROWTH = 2.0
+
+
+def time_build(row_count):
+    medications = [{'name': f'Medication {i}', 'notes': f'Take {i % 3 + 1} times daily'} for i in range(row_count)]
+    best = None
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        doc = SimpleDocTemplate(BytesIO(), pagesize=letter)
+        doc.build([create_medication_table(medications)])
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, doc.page
+
+
+def main():
+    print(f"{'rows':>6} {'pages':>6} {'build ms':>10} {'us/row':>8}")
+    per_row = {}
+    for row_count in ROW_COUNTS:
+        elapsed, pages = time_build(row_count)
+        per_row[row_count] = elapsed / row_count
+        print(f"{row_count:>6} {pages:>6} {elapsed * 1000:>10.2f} {per_row[row_count] * 1e6:>8.1f}")
+
+    growth = per_row[ROW_COUNTS[-1]] / per_row[100]
+    print(f"per-row cost growth 100 -> {ROW_COUNTS[-1]} rows: {growth:.2f}x")
+    if growth > MAX_PER_ROW_GROWTH:
+        print(f"FAIL: table layout is not linear (limit {MAX_PER_ROW_GROWTH}x)")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+import gzip
+import os
+import zlib
+
+import brotli
+
+from limits import MAX_REQUEST_BYTES, PayloadTooLarge
+
+# Encodings we can produce, most preferred first
+RESPONSE_ENCODINGS = ('br', 'gzip')
+# Responses smaller than this go out uncompressed; the savings don't cover the CPU
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '6'))
+# brotli's default quality of 11 is far too slow for per-request use
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', '5'))
+# Decoded request bodies larger than this are rejected rather than inflated into memory
+MAX_DECODED_REQUEST_BYTES = int(os.environ.get('MAX_DECODED_REQUEST_BYTES', str(MAX_REQUEST_BYTES)))
+
+class UnsupportedEncoding(ValueError):
+    pass
+
+class DecodedBodyTooLarge(PayloadTooLarge):
+    pass
+
+def _gunzip(body):
+    decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    decoded = decompressor.decompress(body, MAX_DECODED_REQUEST_BYTES + 1)
+    if len(decoded) > MAX_DECODED_REQUEST_BYTES:
+        raise DecodedBodyTooLarge(f"Decoded request body exceeds {MAX_DECODED_REQUEST_BYTES} bytes")
+    return decoded
+
+def _unbrotli(body):
+    decompressor = brotli.Decompressor()
+    decoded = bytearray()
+    # brotli has no output limit, so feed small chunks and stop soon after the limit is crossed
+    for offset in range(0, len(body), 1024):
+        decoded += decompressor.process(body[offset:offset + 1024])
+        if len(decoded) > MAX_DECODED_REQUEST_BYTES:
+            raise DecodedBodyTooLarge(f"Decoded request body exceeds {MAX_DECODED_REQUEST_BYTES} bytes")
+    return bytes(decoded)
+
+def decode_body(body, content_encoding):
+    """Undo the Content-Encoding of a request body; identity bodies are returned unchanged"""
+    encoding = (content_encoding or 'identity').strip().lower()
+    if encoding == 'identity':
+        return body
+    if encoding in ('gzip', 'x-gzip'):
+        return _gunzip(body)
+    if encoding == 'br':
+        return _unbrotli(body)
+    raise UnsupportedEncoding(f"Unsupported Content-Encoding: {content_encoding}")
+
+def choose_encoding(accept_encoding):
+    """Pick the response encoding from an Accept-Encoding header, or None for identity"""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[coding] = q
+    best = None
+    for encoding in RESPONSE_ENCODINGS:
+        q = weights.get(encoding, weights.get('*', 0.0))
+        if q > 0 and (best is None or q > best[1]):
+            best = (encoding, q)
+    return best[0] if best else None
+
+def encode_body(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    raise UnsupportedEncoding(f"Unsupported encoding: {encoding}")
@@ -0,0 +1,228 @@
+"""Export every participant's packet into archive files for audits.
+
+Run from the pdf-function directory:
+
+    python export.py --jsonl participants.jsonl --output exports/2024-audit
+    python export.py --supabase --output exports/2024-audit --format tar.gz
+
+Packets are rendered in a process pool and written into numbered archive
+parts (packets-0001.zip, ...) of --part-size packets each. A part is recorded
+in checkpoint.json only once it has been closed, so an interrupted export can
+be re-run with the same arguments: participants in completed parts are
+skipped and any partly written part is rewritten from scratch.
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import tarfile
+import time
+import zipfile
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+from io import BytesIO
+
+from participant_sources import JsonlParticipantSource, SupabaseParticipantSource
+from renderer import DOCUMENT_TYPES, build_pdf, resolve_document_types
+
+CHECKPOINT_FILE = 'checkpoint.json'
+ARCHIVE_FORMATS = ('zip', 'tar', 'tar.gz')
+
+# Progress goes to its own logger so it isn't drowned out by the renderer's per-document logging
+logger = logging.getLogger('export')
+
+class ArchiveWriter:
+    """Appends files to a zip or tar archive as they arrive"""
+
+    def __init__(self, path, archive_format):
+        self.path = path
+        if archive_format == 'zip':
+            self._zip = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+            self._tar = None
+        else:
+            self._zip = None
+            self._tar = tarfile.open(path, 'w:gz' if archive_format == 'tar.gz' else 'w')
+
+    def add(self, name, data):
+        if self._zip is not None:
+            self._zip.writestr(name, data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            self._tar.addfile(info, BytesIO(data))
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+        else:
+            self._tar.close()
+
+class ExportCheckpoint:
+    """Completed archive parts and the participants in each, saved atomically after every part"""
+
+    def __init__(self, path, archive_format):
+        self.path = path
+        self.archive_format = archive_format
+        self.parts = []
+        self.failed = {}
+
+    @classmethod
+    def load(cls, path, archive_format):
+        checkpoint = cls(path, archive_format)
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                data = json.load(file)
+            if data['format'] != archive_format:
+                raise ValueError(f"{path} is for a {data['format']} export, not {archive_format}")
+            checkpoint.parts = data['parts']
+            checkpoint.failed = data.get('failed', {})
+        return checkpoint
+
+    def completed_ids(self):
+        return {participant_id for part in self.parts for participant_id in part['participants']}
+
+    def add_part(self, name, participant_ids):
+        self.parts.append({'name': name, 'participants': participant_ids})
+        self.save()
+
+    def save(self):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump({'format': self.archive_format, 'parts': self.parts, 'failed': self.failed}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
+
+def safe_filename_part(value):
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', str(value or ''))[:100]
+
+def render_participant(participant_id, payload, document_types):
+    """Process pool entry point: render one participant's packet to (archive name, PDF bytes)"""
+    document_types = resolve_document_types({**payload, 'documentTypes': document_types})
+    pdf_bytes = build_pdf(payload, document_types)
+    name = '_'.join(safe_filename_part(v) for v in (participant_id, payload.get('firstName'), payload.get('lastName')))
+    return f"{name}.pdf", pdf_bytes
+
+class PacketExporter:
+    """Streams participants through a process pool into checkpointed archive parts"""
+
+    def __init__(self, output_dir, archive_format, workers, part_size, document_types):
+        self.output_dir = output_dir
+        self.archive_format = archive_format
+        self.workers = workers
+        self.part_size = part_size
+        self.document_types = document_types
+        self.checkpoint = ExportCheckpoint.load(os.path.join(output_dir, CHECKPOINT_FILE), archive_format)
+        self._writer = None
+        self._part_ids = []
+
+    def _open_part(self):
+        name = f"packets-{len(self.checkpoint.parts) + 1:04d}.{self.archive_format}"
+        # Overwrites whatever an interrupted run left of this part
+        self._writer = ArchiveWriter(os.path.join(self.output_dir, name), self.archive_format)
+        self._part_ids = []
+
+    def _close_part(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        if self._part_ids:
+            self.checkpoint.add_part(os.path.basename(self._writer.path), self._part_ids)
+            logger.info(f"Completed {os.path.basename(self._writer.path)} with {len(self._part_ids)} packets")
+        else:
+            os.remove(self._writer.path)
+        self._writer = None
+
+    def _write(self, participant_id, name, pdf_bytes):
+        if self._writer is None:
+            self._open_part()
+        self._writer.add(name, pdf_bytes)
+        self._part_ids.append(participant_id)
+        self.checkpoint.failed.pop(participant_id, None)
+        if len(self._part_ids) >= self.part_size:
+            self._close_part()
+
+    def run(self, source):
+        completed = self.checkpoint.completed_ids()
+        if completed:
+            logger.info(f"Resuming export, {len(completed)} participants already exported")
+        started = time.perf_counter()
+        exported = 0
+        # Bounds how many payloads and rendered packets are held in memory at once
+        max_pending = self.workers * 4
+        pending = {}
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                for participant_id, payload in source:
+                    if participant_id in completed:
+                        continue
+                    future = executor.submit(render_participant, participant_id, payload, self.document_types)
+                    pending[future] = participant_id
+                    if len(pending) >= max_pending:
+                        exported += self._drain(pending, FIRST_COMPLETED)
+                exported += self._drain(pending, ALL_COMPLETED)
+        finally:
+            # A cleanly closed part is complete even when the run was interrupted
+            self._close_part()
+            self.checkpoint.save()
+
+        elapsed = time.perf_counter() - started
+        logger.info(f"Exported {exported} packets in {elapsed:.1f}s ({len(self.checkpoint.failed)} failed)")
+        return exported
+
+    def _drain(self, pending, return_when):
+        done, _ = wait(pending, return_when=return_when)
+        exported = 0
+        for future in done:
+            participant_id = pending.pop(future)
+            try:
+                name, pdf_bytes = future.result()
+            except Exception as e:
+                logger.error(f"Error rendering participant {participant_id}: {str(e)}")
+                self.checkpoint.failed[participant_id] = str(e)
+                continue
+            self._write(participant_id, name, pdf_bytes)
+            exported += 1
+        return exported
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    source_group = parser.add_mutually_exclusive_group(required=True)
+    source_group.add_argument('--jsonl', help='JSON Lines dump with one generatePDF payload per line')
+    source_group.add_argument('--supabase', action='store_true',
+                              help='read participants using SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY')
+    parser.add_argument('--output', required=True, help='directory for archive parts and the checkpoint')
+    parser.add_argument('--format', choices=ARCHIVE_FORMATS, default='zip')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--part-size', type=int, default=500, help='packets per archive part')
+    parser.add_argument('--document-types', default=','.join(DOCUMENT_TYPES),
+                        help='comma separated document types to include in every packet')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s %(message)s')
+    logger.setLevel(logging.INFO)
+
+    if args.jsonl:
+        source = JsonlParticipantSource(args.jsonl)
+    else:
+        source = SupabaseParticipantSource(os.environ['SUPABASE_URL'], os.environ['SUPABASE_SERVICE_ROLE_KEY'])
+
+    os.makedirs(args.output, exist_ok=True)
+    exporter = PacketExporter(
+        args.output,
+        args.format,
+        args.workers,
+        args.part_size,
+        [d.strip() for d in args.document_types.split(',') if d.strip()]
+    )
+    try:
+        exporter.run(source)
+    except KeyboardInterrupt:
+        logger.warning("Export interrupted; re-run the same command to resume")
+        return 130
+    return 1 if exporter.checkpoint.failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+from reportlab.platypus import Flowable
+
+class DocumentStart(Flowable):
+    """Zero-size marker placed before each document of a packet.
+
+    It draws nothing in the PDF; renderers use it to tell where one document
+    ends and the next begins.
+    """
+
+    def __init__(self, document_type):
+        Flowable.__init__(self)
+        self.document_type = document_type
+        self.width = 0
+        self.height = 0
+
+    def wrap(self, availWidth, availHeight):
+        return 0, 0
+
+    def draw(self):
+        pass
+
+class StaticPage(Flowable):
+    """Stands in for one page of a pre-rendered static agreement, see static_pages.py.
+
+    It draws nothing; the cached page is drawn beneath the packet page it lands
+    on once layout is done. Without a height it fills whatever is left of the
+    frame. The page holding the agreement's stamp region is given the height of
+    everything above that region, so the signature footer laid out after it
+    lands exactly where the region was reserved.
+    """
+
+    def __init__(self, agreement, index, height=None):
+        Flowable.__init__(self)
+        self.agreement = agreement
+        self.index = index
+        self.fill_height = height is None
+        self.width = 0
+        self.height = height or 0
+
+    def wrap(self, availWidth, availHeight):
+        return availWidth, availHeight if self.fill_height else self.height
+
+    def draw(self):
+        pass
+
+class StampRegion(Flowable):
+    """Blank space reserved at the end of a static agreement for the signature footer.
+
+    Once drawn, page is the (1-based) page it landed on and top the height of
+    its top edge above the bottom of that page.
+    """
+
+    def __init__(self, height):
+        Flowable.__init__(self)
+        self.width = 0
+        self.height = height
+        self.page = None
+        self.top = None
+
+    def wrap(self, availWidth, availHeight):
+        self.width = availWidth
+        return availWidth, self.height
+
+    def draw(self):
+        self.page = self.canv.getPageNumber()
+        self.top = self.canv.absolutePosition(0, self.height)[1]
+
+class PdfOutput:
+    """Write target for a doc template that keeps the finished PDF without copying it.
+
+    reportlab assembles the whole file as one bytes object and writes it in a
+    single call; a BytesIO would copy it into its buffer, and getvalue() would
+    copy it once more.
+    """
+    __slots__ = ('data',)
+
+    def __init__(self):
+        self.data = b''
+
+    def write(self, data):
+        self.data += data
@@ -0,0 +1,279 @@
+"""Render job queues for render_worker.py.
+
+A job is a generatePDF payload under a caller-chosen job id. Workers claim
+one job at a time; a claim is a lease that lapses after lease_seconds, so a
+job whose worker died is picked up again. Every claim counts as an attempt,
+and a job that has used max_attempts is marked failed instead of being
+claimed again, so a packet that kills its worker cannot loop forever.
+
+Queues are opened from a spec, see open_queue:
+
+    sqlite:jobs.db      one SQLite database, safe to share between processes
+    dir:jobs/           a directory of JSON files, one per job
+
+Both are local; they let a backfill run on one Linux box without any other
+service. Each process connects on first use, so a queue may be created
+before the worker processes are forked.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_LEASE_SECONDS = 600
+DEFAULT_MAX_ATTEMPTS = 3
+JOB_STATUSES = ('queued', 'running', 'done', 'failed')
+
+class RenderJob:
+    """A claimed job: its payload and how many times it has been claimed, this claim included"""
+    __slots__ = ('job_id', 'payload', 'attempts')
+
+    def __init__(self, job_id, payload, attempts):
+        self.job_id = job_id
+        self.payload = payload
+        self.attempts = attempts
+
+class SqliteJobQueue:
+    """Jobs in one table of a SQLite database in WAL mode.
+
+    A claim is a single UPDATE ... RETURNING on the oldest claimable row,
+    served by idx_render_jobs_status, so claiming stays cheap however many
+    jobs are queued and no two workers can claim the same job.
+    """
+
+    def __init__(self, path, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        # A connection must not cross a fork
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS render_jobs ("
+                "id TEXT PRIMARY KEY, payload TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'queued', "
+                "attempts INTEGER NOT NULL DEFAULT 0, claimed_by TEXT, claimed_at REAL, "
+                "result TEXT, error TEXT, created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_render_jobs_status ON render_jobs (status, created_at)")
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def put(self, job_id, payload):
+        """Queue a job; returns False when job_id is already known, whatever its status"""
+        cursor = self._connection().execute(
+            "INSERT OR IGNORE INTO render_jobs (id, payload, created_at) VALUES (?, ?, ?)",
+            (job_id, json.dumps(payload), time.time())
+        )
+        return cursor.rowcount == 1
+
+    def put_many(self, jobs):
+        """Queue (job_id, payload) pairs in one transaction; returns how many were new"""
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN")
+        try:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO render_jobs (id, payload, created_at) VALUES (?, ?, ?)",
+                ((job_id, json.dumps(payload), now) for job_id, payload in jobs)
+            )
+            added = conn.total_changes - before
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return added
+
+    def claim(self, worker_id):
+        """Lease the oldest claimable job to worker_id, or return None when there is none"""
+        conn = self._connection()
+        now = time.time()
+        expired = now - self.lease_seconds
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE render_jobs SET status = 'failed', error = 'Lease expired on the last attempt' "
+                "WHERE status = 'running' AND claimed_at < ? AND attempts >= ?",
+                (expired, self.max_attempts)
+            )
+            row = conn.execute(
+                "UPDATE render_jobs SET status = 'running', attempts = attempts + 1, claimed_by = ?, claimed_at = ? "
+                "WHERE id = (SELECT id FROM render_jobs "
+                "WHERE status = 'queued' OR (status = 'running' AND claimed_at < ?) "
+                "ORDER BY created_at LIMIT 1) "
+                "RETURNING id, payload, attempts",
+                (worker_id, now, expired)
+            ).fetchone()
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        return RenderJob(row[0], json.loads(row[1]), row[2])
+
+    def complete(self, job_id, result):
+        self._connection().execute(
+            "UPDATE render_jobs SET status = 'done', payload = '{}', result = ?, error = NULL WHERE id = ?",
+            (json.dumps(result), job_id)
+        )
+
+    def fail(self, job_id, error):
+        """Record a failed attempt: the job is queued again until it has used max_attempts"""
+        self._connection().execute(
+            "UPDATE render_jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+            "error = ?, claimed_by = NULL WHERE id = ?",
+            (self.max_attempts, error, job_id)
+        )
+
+    def release(self, worker_id):
+        """Queue again whatever worker_id had claimed, when the worker is known to be gone"""
+        cursor = self._connection().execute(
+            "UPDATE render_jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+            "error = 'Worker exited during the render', claimed_by = NULL "
+            "WHERE status = 'running' AND claimed_by = ?",
+            (self.max_attempts, worker_id)
+        )
+        return cursor.rowcount
+
+    def counts(self):
+        counts = dict.fromkeys(JOB_STATUSES, 0)
+        counts.update(self._connection().execute("SELECT status, count(*) FROM render_jobs GROUP BY status"))
+        return counts
+
+class DirectoryJobQueue:
+    """Jobs as JSON files in queued/, running/, done/ and failed/ under one directory.
+
+    A job moves between the subdirectories by rename, which is atomic on one
+    filesystem, so when several workers try to claim the same file exactly
+    one of them wins. Expired leases are looked for at most every
+    lease_seconds / 10, by scanning running/, which holds at most one job per
+    worker.
+    """
+
+    def __init__(self, directory, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.directory = directory
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._reclaimed_at = 0.0
+        for status in JOB_STATUSES:
+            os.makedirs(os.path.join(directory, status), exist_ok=True)
+
+    def _path(self, status, job_id):
+        return os.path.join(self.directory, status, f"{job_id}.json")
+
+    def _write(self, path, job):
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(job, file)
+        os.replace(temp_path, path)
+
+    def _read(self, path):
+        with open(path, 'r') as file:
+            return json.load(file)
+
+    def put(self, job_id, payload):
+        """Queue a job; returns False when job_id is already known, whatever its status"""
+        if '/' in job_id or job_id.startswith('.'):
+            raise ValueError(f"Job id can not be used as a file name: {job_id}")
+        if any(os.path.exists(self._path(status, job_id)) for status in JOB_STATUSES):
+            return False
+        self._write(self._path('queued', job_id), {'id': job_id, 'payload': payload, 'attempts': 0})
+        return True
+
+    def put_many(self, jobs):
+        return sum(self.put(job_id, payload) for job_id, payload in jobs)
+
+    def claim(self, worker_id):
+        """Lease a queued job to worker_id, or return None when there is none"""
+        now = time.time()
+        if now - self._reclaimed_at >= self.lease_seconds / 10:
+            self._reclaimed_at = now
+            self._reclaim(lambda job: now - job['claimedAt'] > self.lease_seconds, 'Lease expired on the last attempt')
+        # Directory order rather than enqueue order: sorting would cost a stat per queued job on every claim
+        with os.scandir(os.path.join(self.directory, 'queued')) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.json'):
+                    continue
+                job_id = entry.name[:-len('.json')]
+                running_path = self._path('running', job_id)
+                try:
+                    os.rename(entry.path, running_path)
+                except FileNotFoundError:
+                    # Another worker claimed it first
+                    continue
+                job = self._read(running_path)
+                job['attempts'] += 1
+                job['claimedBy'] = worker_id
+                job['claimedAt'] = now
+                self._write(running_path, job)
+                return RenderJob(job_id, job['payload'], job['attempts'])
+        return None
+
+    def complete(self, job_id, result):
+        self._write(self._path('done', job_id), {'id': job_id, 'result': result})
+        os.remove(self._path('running', job_id))
+
+    def fail(self, job_id, error):
+        """Record a failed attempt: the job is queued again until it has used max_attempts"""
+        running_path = self._path('running', job_id)
+        job = self._read(running_path)
+        job['error'] = error
+        self._requeue(job_id, job)
+
+    def _requeue(self, job_id, job):
+        running_path = self._path('running', job_id)
+        job.pop('claimedBy', None)
+        job.pop('claimedAt', None)
+        status = 'failed' if job['attempts'] >= self.max_attempts else 'queued'
+        # Rewritten in place first, so the rename that hands it back is the only visible step
+        self._write(running_path, job)
+        os.rename(running_path, self._path(status, job_id))
+
+    def _reclaim(self, predicate, error):
+        released = 0
+        with os.scandir(os.path.join(self.directory, 'running')) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    job = self._read(entry.path)
+                except (FileNotFoundError, ValueError):
+                    # Completed meanwhile, or being rewritten by its worker
+                    continue
+                if 'claimedAt' in job and predicate(job):
+                    job['error'] = error
+                    try:
+                        self._requeue(job['id'], job)
+                        released += 1
+                    except FileNotFoundError:
+                        continue
+        return released
+
+    def release(self, worker_id):
+        """Queue again whatever worker_id had claimed, when the worker is known to be gone"""
+        return self._reclaim(lambda job: job['claimedBy'] == worker_id, 'Worker exited during the render')
+
+    def counts(self):
+        counts = {}
+        for status in JOB_STATUSES:
+            with os.scandir(os.path.join(self.directory, status)) as entries:
+                counts[status] = sum(1 for entry in entries if entry.name.endswith('.json'))
+        return counts
+
+QUEUE_TYPES = {'sqlite': SqliteJobQueue, 'dir': DirectoryJobQueue}
+
+def open_queue(spec, **options):
+    """Open the queue a spec such as sqlite:jobs.db or dir:jobs/ names"""
+    kind, _, location = spec.partition(':')
+    if kind not in QUEUE_TYPES or not location:
+        raise ValueError(f"Unknown queue {spec!r}, expected one of: {', '.join(f'{k}:<path>' for k in QUEUE_TYPES)}")
+    return QUEUE_TYPES[kind](location, **options)
@@ -0,0 +1,183 @@
+import logging
+import os
+import threading
+import time
+
+import markdown
+import requests
+
+class CompiledTemplate:
+    """One version of an agreement: its markdown source and, on first use, its HTML"""
+    __slots__ = ('document_type', 'version', 'content', '_html', '_lock')
+
+    def __init__(self, document_type, version, content):
+        self.document_type = document_type
+        self.version = version
+        self.content = content
+        self._html = None
+        self._lock = threading.Lock()
+
+    @property
+    def html(self):
+        if self._html is None:
+            with self._lock:
+                if self._html is None:
+                    self._html = markdown.markdown(self.content)
+        return self._html
+
+class LocalLegalDocumentSource:
+    """Stand-in for the legal_documents table backed by the agreements directory.
+
+    Each agreements/<document_type>.md file is the active version of that
+    document type; its version is derived from the file's mtime and size.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _version(self, path):
+        stat = os.stat(path)
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+    def active_versions(self):
+        versions = {}
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.md'):
+                versions[filename[:-3]] = self._version(os.path.join(self.directory, filename))
+        return versions
+
+    def fetch(self, document_type):
+        path = os.path.join(self.directory, f"{document_type}.md")
+        if not os.path.exists(path):
+            return None
+        version = self._version(path)
+        with open(path, 'r') as file:
+            return version, file.read()
+
+class SupabaseLegalDocumentSource:
+    """Reads the active rows of the legal_documents table through the Supabase REST API"""
+
+    def __init__(self, url, key, timeout=5):
+        self.endpoint = f"{url.rstrip('/')}/rest/v1/legal_documents"
+        self.headers = {'apikey': key, 'Authorization': f"Bearer {key}"}
+        self.timeout = timeout
+
+    def active_versions(self):
+        # Served by idx_legal_documents_active
+        response = requests.get(
+            self.endpoint,
+            params={'select': 'document_type,version', 'is_active': 'eq.true'},
+            headers=self.headers,
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        return {row['document_type']: row['version'] for row in response.json()}
+
+    def fetch(self, document_type):
+        response = requests.get(
+            self.endpoint,
+            params={
+                'select': 'version,content',
+                'document_type': f"eq.{document_type}",
+                'is_active': 'eq.true',
+                'limit': '1'
+            },
+            headers=self.headers,
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        rows = response.json()
+        if not rows:
+            return None
+        return rows[0]['version'], rows[0]['content']
+
+class LegalTemplateCache:
+    """Compiled agreement templates cached per (document_type, version).
+
+    Active versions are re-read from the source at most once every ttl seconds,
+    so requests never fetch templates themselves; a template is recompiled only
+    when its active version changes. Document types the source has no active
+    version for are served from the fallback source.
+    """
+
+    def __init__(self, source, fallback=None, ttl=60):
+        self.source = source
+        self.fallback = fallback
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._versions = {}
+        self._fallback_versions = {}
+        self._checked_at = None
+        self._compiled = {}
+        self._lock = threading.Lock()
+
+    def _refresh_versions(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.ttl:
+            return
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < self.ttl:
+                return
+            # Separately, so an unreachable source still leaves the local templates servable
+            if self.fallback is not None:
+                try:
+                    self._fallback_versions = self.fallback.active_versions()
+                except Exception as e:
+                    logging.error(f"Error refreshing fallback legal document versions: {str(e)}")
+            try:
+                self._versions = self.source.active_versions()
+            except Exception as e:
+                # Keep serving the versions we already know about
+                logging.error(f"Error refreshing legal document versions: {str(e)}")
+            self._checked_at = now
+
+    def get(self, document_type):
+        """Return the CompiledTemplate for the active version of document_type"""
+        self._refresh_versions()
+        if document_type in self._versions:
+            source, versions = self.source, self._versions
+        elif self.fallback is not None and document_type in self._fallback_versions:
+            source, versions = self.fallback, self._fallback_versions
+        else:
+            raise FileNotFoundError(f"No active legal document for {document_type}")
+
+        compiled = self._compiled.get(document_type)
+        if compiled is not None and compiled.version == versions[document_type]:
+            self.hits += 1
+            return compiled
+
+        with self._lock:
+            compiled = self._compiled.get(document_type)
+            if compiled is not None and compiled.version == versions[document_type]:
+                self.hits += 1
+                return compiled
+            self.misses += 1
+            fetched = source.fetch(document_type)
+            if fetched is None:
+                raise FileNotFoundError(f"No active legal document for {document_type}")
+            fetched_version, content = fetched
+            logging.info(f"Loaded {document_type} legal document version {fetched_version}")
+            compiled = CompiledTemplate(document_type, fetched_version, content)
+            # The row may have changed since the last version check
+            versions[document_type] = fetched_version
+            # Replaces (and so releases) the previously active version
+            self._compiled[document_type] = compiled
+            return compiled
+
+    def current_versions(self):
+        """Active version of every known document type, re-checked on the usual ttl"""
+        self._refresh_versions()
+        return {**self._fallback_versions, **self._versions}
+
+def create_template_cache(agreements_dir):
+    """Build the template cache configured by LEGAL_DOCUMENTS_SOURCE (local or supabase)"""
+    local_source = LocalLegalDocumentSource(agreements_dir)
+    ttl = float(os.environ.get('LEGAL_DOCUMENTS_TTL_SECONDS', '60'))
+    if os.environ.get('LEGAL_DOCUMENTS_SOURCE', 'local') == 'supabase':
+        source = SupabaseLegalDocumentSource(
+            os.environ['SUPABASE_URL'],
+            os.environ['SUPABASE_SERVICE_ROLE_KEY']
+        )
+        return LegalTemplateCache(source, fallback=local_source, ttl=ttl)
+    return LegalTemplateCache(local_source, ttl=ttl)
@@ -0,0 +1,95 @@
+import os
+
+def _env_int(name, default):
+    return int(os.environ.get(name, str(default)))
+
+# Largest JSON body accepted, after any Content-Encoding is removed
+MAX_REQUEST_BYTES = _env_int('MAX_REQUEST_BYTES', 2 * 1024 * 1024)
+# Longest list accepted for any field, unless LIST_LIMITS says otherwise
+MAX_LIST_ITEMS = _env_int('MAX_LIST_ITEMS', 50)
+LIST_LIMITS = {
+    'documentTypes': 20,
+    'medications': _env_int('MAX_MEDICATIONS', 100),
+    'pendingCharges': _env_int('MAX_PENDING_CHARGES', 50),
+    'convictions': _env_int('MAX_CONVICTIONS', 50),
+    'authorizedPeople': _env_int('MAX_AUTHORIZED_PEOPLE', 20),
+    'signatures': 50,
+}
+# Longest string accepted for any field, unless STRING_LIMITS says otherwise
+MAX_STRING_LENGTH = _env_int('MAX_STRING_LENGTH', 500)
+STRING_LIMITS = {
+    'additionalInformation': _env_int('MAX_FREE_TEXT_LENGTH', 5000),
+    'chargeDescription': 1000,
+    'offense': 1000,
+    'notes': 1000,
+    # Data URL signature images
+    'signature': _env_int('MAX_SIGNATURE_IMAGE_LENGTH', 300_000),
+    'signatureImage': _env_int('MAX_SIGNATURE_IMAGE_LENGTH', 300_000),
+    'witnessSignature': _env_int('MAX_SIGNATURE_IMAGE_LENGTH', 300_000),
+}
+MAX_OBJECT_FIELDS = 100
+MAX_NESTING_DEPTH = 6
+# Stop collecting after this many, the first few are enough to fix the payload
+MAX_REPORTED_VIOLATIONS = 20
+# Wall-clock seconds a single render may spend laying out pages
+MAX_RENDER_SECONDS = float(os.environ.get('MAX_RENDER_SECONDS', '20'))
+
+class PayloadTooLarge(ValueError):
+    """The request body is over MAX_REQUEST_BYTES (413)"""
+
+class PayloadRejected(ValueError):
+    """The payload breaks a list, string or nesting limit, or names its documents wrongly (422)"""
+
+    def __init__(self, violations):
+        ValueError.__init__(self, f"Payload exceeds rendering limits: {'; '.join(violations[:5])}")
+        self.violations = violations
+
+class RenderBudgetExceeded(RuntimeError):
+    """Layout ran past the per-request render budget (422)"""
+
+def check_body_size(size):
+    if size > MAX_REQUEST_BYTES:
+        raise PayloadTooLarge(f"Request body is {size} bytes; the limit is {MAX_REQUEST_BYTES}")
+
+def check_payload(req_body):
+    """Raise PayloadRejected listing every list, string and nesting limit the payload breaks.
+
+    Runs before any rendering, so the cost is one walk over the parsed JSON.
+    """
+    if not isinstance(req_body, dict):
+        raise PayloadRejected(["Request body must be a JSON object"])
+    violations = []
+    # A string here would otherwise be read one character per document type
+    document_types = req_body.get('documentTypes')
+    if document_types is not None and not (
+            isinstance(document_types, list) and all(isinstance(t, str) for t in document_types)):
+        violations.append("documentTypes must be a list of strings")
+    if req_body.get('documentType') is not None and not isinstance(req_body['documentType'], str):
+        violations.append("documentType must be a string")
+    _check_value(req_body, '', None, 0, violations)
+    if violations:
+        raise PayloadRejected(violations)
+
+def _check_value(value, path, field, depth, violations):
+    if len(violations) >= MAX_REPORTED_VIOLATIONS:
+        return
+    if depth > MAX_NESTING_DEPTH:
+        violations.append(f"{path or 'body'} is nested more than {MAX_NESTING_DEPTH} levels deep")
+        return
+    if isinstance(value, str):
+        limit = STRING_LIMITS.get(field, MAX_STRING_LENGTH)
+        if len(value) > limit:
+            violations.append(f"{path} is {len(value)} characters; the limit is {limit}")
+    elif isinstance(value, list):
+        limit = LIST_LIMITS.get(field, MAX_LIST_ITEMS)
+        if len(value) > limit:
+            violations.append(f"{path} has {len(value)} items; the limit is {limit}")
+            return
+        for i, item in enumerate(value):
+            _check_value(item, f"{path}[{i}]", field, depth + 1, violations)
+    elif isinstance(value, dict):
+        if len(value) > MAX_OBJECT_FIELDS:
+            violations.append(f"{path or 'body'} has {len(value)} fields; the limit is {MAX_OBJECT_FIELDS}")
+            return
+        for key, item in value.items():
+            _check_value(item, f"{path}.{key}" if path else key, key, depth + 1, violations)
@@ -0,0 +1,142 @@
+import threading
+
+# Prometheus text exposition format version served by render_metrics()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_registry = []
+_collectors = []
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """Base for in-process metrics; values are keyed by a tuple of label values"""
+    kind = None
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_samples(items))
+        return lines
+
+    def _render_samples(self, items):
+        return [f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}' for key, value in items]
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value, **labels):
+        """Mirror a total counted elsewhere, e.g. functools.lru_cache statistics"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            bucket_counts = state[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    bucket_counts[i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _render_samples(self, items):
+        lines = []
+        for key, (bucket_counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, key, [('le', _format_value(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.label_names, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+def register_collector(collector):
+    """Register a callable run at scrape time, used for values owned by other modules such as cache stats"""
+    _collectors.append(collector)
+    return collector
+
+def render_metrics():
+    """Render every registered metric in Prometheus text format"""
+    for collector in _collectors:
+        collector()
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+PDF_REQUESTS = Counter('pdf_requests_total', 'PDF documents requested, by document type.', ['document_type'])
+PDF_STAGE_SECONDS = Histogram('pdf_render_stage_seconds', 'Time spent in each PDF generation stage.', ['stage'])
+PDF_OUTPUT_BYTES = Histogram(
+    'pdf_output_bytes', 'Size of generated PDF packets in bytes.',
+    buckets=(10_000, 25_000, 50_000, 100_000, 250_000, 500_000, 1_000_000, 2_500_000, 5_000_000)
+)
+PDF_PAGES = Histogram('pdf_pages', 'Page count of generated PDF packets.', buckets=(1, 2, 5, 10, 15, 20, 30, 50, 100))
+PDF_ERRORS = Counter('pdf_errors_total', 'Errors caught while generating PDFs, by branch.', ['branch'])
+PDF_CACHE_HITS = Counter('pdf_cache_hits_total', 'In-process cache hits, by cache.', ['cache'])
+PDF_CACHE_MISSES = Counter('pdf_cache_misses_total', 'In-process cache misses, by cache.', ['cache'])
+PDF_CACHE_HIT_RATIO = Gauge('pdf_cache_hit_ratio', 'Hit ratio of in-process caches since worker start.', ['cache'])
+PDF_COMPRESSION_SAVED_BYTES = Counter(
+    'pdf_compression_saved_bytes_total', 'Bytes saved by compressed transport, by direction and encoding.',
+    ['direction', 'encoding']
+)
+PDF_WARMUP_SECONDS = Gauge('pdf_warmup_seconds', 'Duration of the most recent warm-up render.')
+
+def record_cache_stats(cache, hits, misses):
+    """Publish absolute hit/miss totals for a cache that keeps its own counters"""
+    PDF_CACHE_HITS.set_total(hits, cache=cache)
+    PDF_CACHE_MISSES.set_total(misses, cache=cache)
+    total = hits + misses
+    PDF_CACHE_HIT_RATIO.set(hits / total if total else 0.0, cache=cache)
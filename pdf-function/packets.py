@@ -0,0 +1,151 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from pypdf import PdfReader, PdfWriter
+
+# Request fields that choose what to return from a packet rather than what goes into it
+SELECTION_FIELDS = ('documents', 'pages', 'delivery')
+
+class RenderedPacket:
+    """A rendered PDF packet and the page range of each document in it"""
+    __slots__ = ('pdf_bytes', 'page_count', 'page_index')
+
+    def __init__(self, pdf_bytes, page_count, page_index):
+        self.pdf_bytes = pdf_bytes
+        self.page_count = page_count
+        # document_type -> (first_page, last_page), 1-based and inclusive
+        self.page_index = page_index
+
+def build_page_index(document_starts, page_count):
+    """Turn the (document_type, first_page) pairs seen during layout into inclusive page ranges"""
+    page_index = {}
+    for i, (document_type, first_page) in enumerate(document_starts):
+        if i + 1 < len(document_starts):
+            last_page = max(first_page, document_starts[i + 1][1] - 1)
+        else:
+            last_page = page_count
+        page_index[document_type] = (first_page, last_page)
+    return page_index
+
+def packet_key(req_body, document_types, template_versions):
+    """Stable cache key for the packet a request renders, ignoring page/document selection"""
+    content = {k: v for k, v in req_body.items() if k not in SELECTION_FIELDS}
+    canonical = json.dumps(
+        [content, document_types, sorted(template_versions.items())],
+        sort_keys=True, separators=(',', ':'), default=str
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+class PacketCache:
+    """Thread-safe LRU of rendered packets bounded by their total size in bytes"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            packet = self._entries.get(key)
+            if packet is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return packet
+
+    def put(self, key, packet):
+        size = len(packet.pdf_bytes)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous.pdf_bytes)
+            self._entries[key] = packet
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted.pdf_bytes)
+
+def parse_page_range(spec, page_count):
+    """Parse a 1-based page selection such as "2-4,7" into an ordered list of page numbers"""
+    pages = []
+    seen = set()
+    for part in str(spec).split(','):
+        part = part.strip()
+        if not part:
+            continue
+        start, sep, end = part.partition('-')
+        try:
+            first = int(start)
+            last = int(end) if sep else first
+        except ValueError:
+            raise ValueError(f"Invalid page range: {part}")
+        if first < 1 or last < first or last > page_count:
+            raise ValueError(f"Page range {part} is outside 1-{page_count}")
+        for page in range(first, last + 1):
+            if page not in seen:
+                seen.add(page)
+                pages.append(page)
+    if not pages:
+        raise ValueError("Empty page range")
+    return pages
+
+def selected_pages(packet, documents=None, pages=None):
+    """Resolve a document subset and/or page range to packet page numbers.
+
+    Pages are packet page numbers; when documents are also given, only pages
+    that belong to those documents are kept.
+    """
+    if documents:
+        missing = [d for d in documents if d not in packet.page_index]
+        if missing:
+            raise KeyError(f"Documents not in packet: {', '.join(missing)}")
+        document_pages = []
+        for document_type in documents:
+            first, last = packet.page_index[document_type]
+            document_pages.extend(p for p in range(first, last + 1) if p not in document_pages)
+        document_page_set = set(document_pages)
+    else:
+        document_pages = None
+
+    if pages:
+        page_numbers = parse_page_range(pages, packet.page_count)
+        if document_pages is not None:
+            page_numbers = [p for p in page_numbers if p in document_page_set]
+        return page_numbers
+    return document_pages
+
+def extract_pages(pdf_bytes, page_numbers):
+    """Copy the given 1-based pages of a PDF into a new, smaller PDF"""
+    reader = PdfReader(BytesIO(pdf_bytes))
+    writer = PdfWriter()
+    for page_number in page_numbers:
+        writer.add_page(reader.pages[page_number - 1])
+    output = BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+def content_etag(pdf_bytes):
+    """Strong ETag for a PDF, from its bytes before any Content-Encoding"""
+    return f'"{hashlib.sha256(pdf_bytes).hexdigest()}"'
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header matches etag, by the weak comparison RFC 9110 uses for it"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if (candidate[2:] if candidate.startswith('W/') else candidate) == opaque:
+            return True
+    return False
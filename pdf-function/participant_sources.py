@@ -0,0 +1,231 @@
+import json
+import logging
+
+import requests
+
+from signatures import share_signature_images
+
+# Related tables embedded with each participant, see route.ts in src/app/api/generate-pdf
+RELATED_TABLES = (
+    'health_status', 'vehicles', 'emergency_contacts', 'medical_information', 'medications',
+    'authorized_people', 'legal_status', 'signatures', 'mental_health', 'drug_history',
+    'pending_charges', 'convictions'
+)
+
+class ParticipantAccessDenied(Exception):
+    """The caller may not load participants: no access token, or Supabase refused it (401)"""
+
+def _one(value):
+    """PostgREST embeds one-to-many relations as lists; the single-row tables want one row"""
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+def participant_payload(row):
+    """Map a participants row with its embedded related rows to the generatePDF payload"""
+    health_status = _one(row.get('health_status'))
+    vehicle = _one(row.get('vehicles'))
+    emergency_contact = _one(row.get('emergency_contacts'))
+    medical_info = _one(row.get('medical_information'))
+    legal_status = _one(row.get('legal_status'))
+    mental_health = _one(row.get('mental_health'))
+
+    return {
+        'participantId': row['id'],
+        'firstName': row.get('first_name'),
+        'lastName': row.get('last_name'),
+        'intakeDate': row.get('intake_date'),
+        'housingLocation': row.get('housing_location'),
+        'dateOfBirth': row.get('date_of_birth'),
+        'socialSecurityNumber': row.get('social_security_number'),
+        'sex': row.get('sex'),
+        'email': row.get('email'),
+        'driversLicenseNumber': row.get('drivers_license_number'),
+        'phoneNumber': row.get('phone_number'),
+        'healthStatus': {
+            'pregnant': health_status.get('pregnant'),
+            'developmentallyDisabled': health_status.get('developmentally_disabled'),
+            'coOccurringDisorder': health_status.get('co_occurring_disorder'),
+            'docSupervision': health_status.get('doc_supervision'),
+            'felon': health_status.get('felon'),
+            'physicallyHandicapped': health_status.get('physically_handicapped'),
+            'postPartum': health_status.get('post_partum'),
+            'primaryFemaleCaregiver': health_status.get('primary_female_caregiver'),
+            'recentlyIncarcerated': health_status.get('recently_incarcerated'),
+            'sexOffender': health_status.get('sex_offender'),
+            'lgbtq': health_status.get('lgbtq'),
+            'veteran': health_status.get('veteran'),
+            'insulinDependent': health_status.get('insulin_dependent'),
+            'historyOfSeizures': health_status.get('history_of_seizures'),
+            'race': health_status.get('race'),
+            'ethnicity': health_status.get('ethnicity'),
+            'householdIncome': health_status.get('household_income'),
+            'employmentStatus': health_status.get('employment_status')
+        } if health_status else None,
+        'vehicle': {
+            'make': vehicle.get('make'),
+            'model': vehicle.get('model'),
+            'tagNumber': vehicle.get('tag_number'),
+            'insured': vehicle.get('insured'),
+            'insuranceType': vehicle.get('insurance_type'),
+            'policyNumber': vehicle.get('policy_number')
+        } if vehicle else None,
+        'emergencyContact': {
+            'firstName': emergency_contact.get('first_name'),
+            'lastName': emergency_contact.get('last_name'),
+            'phone': emergency_contact.get('phone'),
+            'relationship': emergency_contact.get('relationship'),
+            'otherRelationship': emergency_contact.get('other_relationship')
+        } if emergency_contact else None,
+        'medicalInformation': {
+            'dualDiagnosis': medical_info.get('dual_diagnosis'),
+            'mat': medical_info.get('mat'),
+            'matMedication': medical_info.get('mat_medication'),
+            'matMedicationOther': medical_info.get('mat_medication_other'),
+            'needPsychMedication': medical_info.get('need_psych_medication')
+        } if medical_info else None,
+        'medications': [
+            {
+                'name': med.get('medication_name', ''),
+                'notes': ', '.join(v for v in (med.get('dosage'), med.get('frequency')) if v)
+            }
+            for med in row.get('medications') or []
+        ],
+        'authorizedPeople': [
+            {
+                'firstName': person.get('first_name'),
+                'lastName': person.get('last_name'),
+                'relationship': person.get('relationship'),
+                'phone': person.get('phone')
+            }
+            for person in row.get('authorized_people') or []
+        ],
+        'legalStatus': {
+            'hasProbationPretrial': legal_status.get('has_probation_pretrial'),
+            'jurisdiction': legal_status.get('jurisdiction'),
+            'otherJurisdiction': legal_status.get('other_jurisdiction'),
+            'hasPendingCharges': legal_status.get('has_pending_charges'),
+            'hasConvictions': legal_status.get('has_convictions'),
+            'isWanted': legal_status.get('is_wanted'),
+            'isOnBond': legal_status.get('is_on_bond'),
+            'bondsmanName': legal_status.get('bondsman_name'),
+            'isSexOffender': legal_status.get('is_sex_offender')
+        } if legal_status else None,
+        'signatures': [
+            {
+                'signatureType': sig.get('signature_type'),
+                'signature': sig.get('signature'),
+                'signatureId': sig.get('signature_id'),
+                'signatureTimestamp': sig.get('signature_timestamp'),
+                'witnessSignature': sig.get('witness_signature'),
+                'witnessTimestamp': sig.get('witness_timestamp'),
+                'witnessSignatureId': sig.get('witness_signature_id'),
+                'agreed': sig.get('agreed'),
+                'updates': sig.get('updates') or {}
+            }
+            for sig in row.get('signatures') or []
+        ],
+        'mentalHealth': {
+            'entries': mental_health.get('entries') or [],
+            'suicidalIdeation': mental_health.get('suicidal_ideation'),
+            'homicidalIdeation': mental_health.get('homicidal_ideation'),
+            'hallucinations': mental_health.get('hallucinations')
+        } if mental_health else None,
+        'drugHistory': [
+            {
+                'drugType': entry.get('drug_type'),
+                'everUsed': entry.get('ever_used'),
+                'dateLastUse': entry.get('date_last_use'),
+                'frequency': entry.get('frequency'),
+                'intravenous': entry.get('intravenous'),
+                'totalYears': entry.get('total_years'),
+                'amount': entry.get('amount')
+            }
+            for entry in row.get('drug_history') or []
+        ],
+        'pendingCharges': [
+            {'chargeDescription': charge.get('charge_description') or '', 'location': charge.get('jurisdiction') or ''}
+            for charge in row.get('pending_charges') or []
+        ],
+        'convictions': [
+            {'offense': conviction.get('conviction_description') or ''}
+            for conviction in row.get('convictions') or []
+        ]
+    }
+
+class JsonlParticipantSource:
+    """Reads generatePDF payloads from a JSON Lines dump, one participant per line"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        with open(self.path, 'r') as file:
+            for line_number, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    payload = json.loads(line)
+                except ValueError as e:
+                    logging.error(f"Skipping line {line_number} of {self.path}: {str(e)}")
+                    continue
+                # Also lets pickle send each distinct image to the export workers once
+                share_signature_images(payload.get('signatures'))
+                participant_id = str(payload.get('participantId') or payload.get('id') or f"line-{line_number}")
+                yield participant_id, payload
+
+class SupabaseParticipantSource:
+    """Streams every participant with its related rows through the Supabase REST API.
+
+    Participants are fetched a page at a time in id order, each page in one
+    request that embeds the related tables (served by their participant_id
+    indexes), so memory stays flat however many participants there are.
+    """
+
+    def __init__(self, url, key, page_size=100, timeout=30):
+        self.endpoint = f"{url.rstrip('/')}/rest/v1/participants"
+        self.headers = {'apikey': key, 'Authorization': f"Bearer {key}"}
+        self.page_size = page_size
+        self.timeout = timeout
+
+    def _select(self):
+        return ','.join(['*'] + [f"{table}(*)" for table in RELATED_TABLES])
+
+    def load(self, participant_id, access_token=None):
+        """Return the generatePDF payload for one participant, or None when there is no such participant.
+
+        PostgREST turns the embedded tables into a single SQL query, so this is
+        one round-trip however many related tables there are. With an
+        access_token the query runs as that user, so row level security
+        decides what they can load; a participant they may not see is None.
+        """
+        headers = self.headers
+        if access_token is not None:
+            headers = {**headers, 'Authorization': f"Bearer {access_token}"}
+        response = requests.get(
+            self.endpoint,
+            params={'select': self._select(), 'id': f"eq.{participant_id}"},
+            headers=headers,
+            timeout=self.timeout
+        )
+        if response.status_code in (401, 403):
+            raise ParticipantAccessDenied("The access token was not accepted")
+        response.raise_for_status()
+        rows = response.json()
+        return participant_payload(rows[0]) if rows else None
+
+    def __iter__(self):
+        select = self._select()
+        last_id = None
+        while True:
+            params = {'select': select, 'order': 'id.asc', 'limit': str(self.page_size)}
+            if last_id is not None:
+                params['id'] = f"gt.{last_id}"
+            response = requests.get(self.endpoint, params=params, headers=self.headers, timeout=self.timeout)
+            response.raise_for_status()
+            rows = response.json()
+            for row in rows:
+                yield row['id'], participant_payload(row)
+            if len(rows) < self.page_size:
+                return
+            last_id = rows[-1]['id']
@@ -0,0 +1,136 @@
+import base64
+import html
+from html.parser import HTMLParser
+
+from reportlab.platypus import Image, PageBreak, Paragraph, Spacer, Table
+
+from flowables import DocumentStart
+from signatures import SignatureImage
+
+# Paragraph style name -> HTML tag, mirroring getSampleStyleSheet() sizes in PREVIEW_CSS
+HEADING_TAGS = {'Title': 'h1', 'Heading1': 'h2', 'Heading2': 'h3', 'Heading3': 'h4'}
+
+# Inline markup allowed through from paragraph text. Block tags are dropped because,
+# as in the PDF, every line of agreement HTML already becomes its own paragraph.
+ALLOWED_TAGS = {'b', 'strong', 'i', 'em', 'u', 'br', 'code', 'sub', 'sup'}
+VOID_TAGS = {'br'}
+
+PREVIEW_CSS = """
+body { background: #e5e7eb; margin: 0; font-family: Helvetica, Arial, sans-serif; font-size: 10pt; line-height: 12pt; }
+.page { background: #fff; width: 6.5in; margin: 0.25in auto; padding: 1in; box-shadow: 0 1px 3px rgba(0,0,0,.2); }
+h1 { font-size: 18pt; line-height: 22pt; text-align: center; }
+h2 { font-size: 18pt; line-height: 22pt; }
+h3 { font-size: 14pt; line-height: 18pt; }
+h4 { font-size: 12pt; line-height: 14pt; }
+p.DigitalSignature { text-align: center; color: #808080; }
+p.Key { font-size: 8pt; text-align: center; }
+table { border-collapse: collapse; margin: 6pt 0; }
+td { border: 0.5pt solid #000; padding: 6pt; vertical-align: top; }
+.signature { display: block; margin: 0 auto; max-width: 2.5in; max-height: 0.75in; }
+"""
+
+class _MarkupSanitizer(HTMLParser):
+    """Keep a small whitelist of attribute-free inline/block tags and escape everything else"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ALLOWED_TAGS:
+            self.parts.append(f"<{tag}>")
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in ALLOWED_TAGS:
+            self.parts.append(f"<{tag}>" if tag in VOID_TAGS else f"<{tag}></{tag}>")
+
+    def handle_endtag(self, tag):
+        if tag in ALLOWED_TAGS and tag not in VOID_TAGS:
+            self.parts.append(f"</{tag}>")
+
+    def handle_data(self, data):
+        self.parts.append(html.escape(data, quote=False))
+
+def sanitize_markup(markup):
+    parser = _MarkupSanitizer()
+    parser.feed(markup)
+    parser.close()
+    return ''.join(parser.parts)
+
+def _color_hex(color):
+    return '#' + color.hexval()[2:]
+
+def _table_html(table):
+    rows = table._cellvalues
+    row_count = len(rows)
+    column_count = len(rows[0]) if rows else 0
+    backgrounds = {}
+    for command in getattr(table, '_bkgrndcmds', []):
+        if command[0] != 'BACKGROUND':
+            continue
+        (c0, r0), (c1, r1), color = command[1], command[2], command[3]
+        c0, c1 = c0 % column_count, c1 % column_count
+        r0, r1 = r0 % row_count, r1 % row_count
+        for r in range(r0, r1 + 1):
+            for c in range(c0, c1 + 1):
+                backgrounds[(r, c)] = _color_hex(color)
+
+    out = ['<table>']
+    for r, row in enumerate(rows):
+        out.append('<tr>')
+        for c, value in enumerate(row):
+            css = []
+            if table._argW and table._argW[c]:
+                css.append(f"width: {table._argW[c]:.0f}pt")
+            if table._cellStyles[r][c].fontname.endswith('-Bold'):
+                css.append('font-weight: bold')
+            if (r, c) in backgrounds:
+                css.append(f"background: {backgrounds[(r, c)]}")
+            if isinstance(value, str):
+                content = html.escape(value)
+            elif isinstance(value, Paragraph):
+                content = sanitize_markup(value.text)
+            else:
+                content = ''
+            style = f' style="{"; ".join(css)}"' if css else ''
+            out.append(f"<td{style}>{content}</td>")
+        out.append('</tr>')
+    out.append('</table>')
+    return ''.join(out)
+
+def render_preview_html(elements, title):
+    """Render packet flowables to a standalone HTML page without any reportlab layout"""
+    out = [
+        '<!DOCTYPE html><html><head><meta charset="utf-8">',
+        f"<title>{html.escape(title)}</title>",
+        f"<style>{PREVIEW_CSS}</style></head><body>",
+        '<div class="page">',
+    ]
+    for element in elements:
+        if isinstance(element, DocumentStart):
+            out.append(f'<a id="{html.escape(element.document_type)}"></a>')
+        elif isinstance(element, PageBreak):
+            out.append('</div><div class="page">')
+        elif isinstance(element, Paragraph):
+            style_name = element.style.name
+            tag = HEADING_TAGS.get(style_name)
+            if tag:
+                out.append(f"<{tag}>{sanitize_markup(element.text)}</{tag}>")
+            else:
+                out.append(f'<p class="{html.escape(style_name)}">{sanitize_markup(element.text)}</p>')
+        elif isinstance(element, Table):
+            out.append(_table_html(element))
+        elif isinstance(element, SignatureImage):
+            raw = getattr(element.reader, 'raw', None)
+            if raw:
+                mime = 'image/jpeg' if raw.startswith(b'\xff\xd8') else 'image/png'
+                encoded = base64.b64encode(raw).decode('ascii')
+                out.append(f'<img class="signature" alt="Signature" src="data:{mime};base64,{encoded}">')
+        elif isinstance(element, Spacer):
+            out.append(f'<div style="height: {element.height:.0f}pt"></div>')
+        elif isinstance(element, Image):
+            # The logo is only drawn in the PDF
+            continue
+    out.append('</div></body></html>')
+    # Drop pages left empty by back-to-back page breaks
+    return ''.join(out).replace('<div class="page"></div>', '')
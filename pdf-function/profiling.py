@@ -0,0 +1,98 @@
+import cProfile
+import hmac
+import io
+import logging
+import os
+import pstats
+import re
+import tempfile
+import threading
+import tracemalloc
+import uuid
+
+PROFILE_MODES = ('cpu', 'mem')
+# The deployed app directory may be read-only, so reports go to temp storage by default
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'jhonboard-profiles'))
+PROFILE_TOP_N = 50
+# The allocation tracer and its peak are process wide, so mem profiles run one at a time
+_mem_profile_lock = threading.Lock()
+
+def requested_profile_mode(headers):
+    """Return 'cpu' or 'mem' when the request asks for profiling and carries the configured secret.
+
+    Profiling is off unless PROFILE_SECRET is set and X-Profile-Secret matches it,
+    so requests without an X-Profile header only pay for one header lookup.
+    """
+    mode = headers.get('X-Profile')
+    if not mode:
+        return None
+    secret = os.environ.get('PROFILE_SECRET', '')
+    if not secret or not hmac.compare_digest(headers.get('X-Profile-Secret', ''), secret):
+        logging.warning("Ignoring X-Profile header without a valid X-Profile-Secret")
+        return None
+    mode = mode.strip().lower()
+    if mode not in PROFILE_MODES:
+        logging.warning(f"Ignoring unsupported X-Profile mode: {mode}")
+        return None
+    return mode
+
+def _report_path(request_id, mode, extension):
+    safe_id = re.sub(r'[^A-Za-z0-9_.-]', '_', request_id)[:100] or 'unknown'
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    return os.path.join(PROFILE_DIR, f"{safe_id}-{mode}.{extension}")
+
+def _write_report(request_id, mode, write):
+    """Call write(path) for the text report; a failure is logged, never raised into the render's response"""
+    try:
+        path = _report_path(request_id, mode, 'txt')
+        write(path)
+    except Exception as e:
+        logging.error(f"Writing the {mode} profile for request {request_id} failed: {str(e)}")
+        return
+    logging.info(f"Wrote {mode} profile for request {request_id} to {path}")
+
+def run_profiled(mode, request_id, function, *args, **kwargs):
+    """Call function under a CPU profiler or allocation tracer and write the report for request_id.
+
+    Requests without an X-Request-ID (request_id 'unknown') get a generated
+    one, so their reports do not overwrite each other.
+    """
+    if not request_id or request_id == 'unknown':
+        request_id = f"unknown-{uuid.uuid4().hex[:12]}"
+    if mode == 'cpu':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profiler.disable()
+
+            def write(path):
+                profiler.dump_stats(_report_path(request_id, mode, 'prof'))
+                report = io.StringIO()
+                pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(PROFILE_TOP_N)
+                with open(path, 'w') as file:
+                    file.write(report.getvalue())
+            _write_report(request_id, mode, write)
+
+    # Other requests rendering meanwhile still show up in the report, but no other
+    # mem profile can stop the tracer or reset the peak under this one
+    with _mem_profile_lock:
+        already_tracing = tracemalloc.is_tracing()
+        if not already_tracing:
+            tracemalloc.start(25)
+        tracemalloc.reset_peak()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            if not already_tracing:
+                tracemalloc.stop()
+            lines = [f"Request {request_id}: current {current} bytes, peak {peak} bytes", ""]
+            lines.extend(str(stat) for stat in snapshot.statistics('lineno')[:PROFILE_TOP_N])
+
+            def write(path):
+                with open(path, 'w') as file:
+                    file.write('\n'.join(lines) + '\n')
+            _write_report(request_id, mode, write)
@@ -0,0 +1,275 @@
+"""Render packets from a job queue outside Azure Functions, one process per core.
+
+Run from the pdf-function directory:
+
+    python render_worker.py enqueue --queue sqlite:jobs.db --jsonl participants.jsonl
+    python render_worker.py run --queue sqlite:jobs.db --output packets/ --drain
+    python render_worker.py status --queue sqlite:jobs.db
+
+run is a prefork server: the parent loads the renderer and renders one
+packet so templates, fonts and styles are in memory, then forks --processes
+workers that share those pages. Each worker claims a job, renders it and
+writes the PDF to --output (as <job id>.pdf) or to the artifact store in
+--artifacts, then records the result in the queue. A worker exits after
+--max-jobs-per-child jobs and is replaced, so fragmentation from a long
+backfill does not accumulate. A worker that dies mid-render has its job
+queued again right away rather than when its lease expires.
+
+SIGTERM or Ctrl-C lets every worker finish the packet it is rendering and
+stops. With --drain the workers stop once the queue is empty; otherwise they
+keep polling for new jobs.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import socket
+import sys
+import time
+
+from artifacts import LocalArtifactStore
+from export import safe_filename_part
+from job_queues import DEFAULT_LEASE_SECONDS, DEFAULT_MAX_ATTEMPTS, open_queue
+from limits import MAX_RENDER_SECONDS
+from participant_sources import JsonlParticipantSource, SupabaseParticipantSource
+from renderer import DOCUMENT_TYPES, build_pdf, render_packet, resolve_document_types
+from signatures import share_signature_images
+
+# Worker exit codes the supervisor acts on; anything else is a crash
+EXIT_STOPPED = 0
+EXIT_RECYCLED = 3
+ENQUEUE_BATCH_SIZE = 500
+PROGRESS_INTERVAL_SECONDS = 30
+
+logger = logging.getLogger('render_worker')
+
+class DirectoryOutput:
+    """Writes each packet to <directory>/<job id>.pdf, replacing it atomically"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, job_id, pdf_bytes):
+        path = os.path.join(self.directory, f"{safe_filename_part(job_id)}.pdf")
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(pdf_bytes)
+        os.replace(temp_path, path)
+        return {'path': path}
+
+class ArtifactOutput:
+    """Stores each packet in the content-addressed artifact store that generatePDF serves from"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def write(self, job_id, pdf_bytes):
+        return {'artifactKey': self.store.put(pdf_bytes)}
+
+def worker_id(pid):
+    return f"{socket.gethostname()}:{pid}"
+
+def render_job(job, output, time_budget):
+    """Render one claimed job and write it out; returns the result recorded in the queue"""
+    payload = job.payload
+    share_signature_images(payload.get('signatures'))
+    started = time.perf_counter()
+    packet = render_packet(payload, resolve_document_types(payload), time_budget=time_budget)
+    result = output.write(job.job_id, packet.pdf_bytes)
+    result.update({
+        'pages': packet.page_count,
+        'bytes': len(packet.pdf_bytes),
+        'documents': packet.page_index,
+        'seconds': round(time.perf_counter() - started, 3),
+    })
+    return result
+
+def work(queue, output, max_jobs, poll_interval, drain, time_budget):
+    """Worker process loop: claim, render, record, until stopped, drained or due for recycling"""
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    # Ctrl-C reaches the whole process group; let the supervisor decide, after the current packet
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    me = worker_id(os.getpid())
+    rendered = 0
+    while not stopping:
+        if max_jobs and rendered >= max_jobs:
+            sys.exit(EXIT_RECYCLED)
+        job = queue.claim(me)
+        if job is None:
+            if drain:
+                break
+            time.sleep(poll_interval)
+            continue
+        try:
+            result = render_job(job, output, time_budget)
+        except Exception as e:
+            logger.error(f"Job {job.job_id} failed on attempt {job.attempts}: {str(e)}")
+            queue.fail(job.job_id, str(e))
+        else:
+            queue.complete(job.job_id, result)
+        rendered += 1
+    sys.exit(EXIT_STOPPED)
+
+class PreforkSupervisor:
+    """Keeps a fixed number of worker processes rendering from one queue into one output"""
+
+    def __init__(self, queue, output, processes, max_jobs_per_child=0, poll_interval=1.0, drain=False,
+                 time_budget=MAX_RENDER_SECONDS):
+        self.queue = queue
+        self.output = output
+        self.processes = processes
+        self.worker_args = (queue, output, max_jobs_per_child, poll_interval, drain, time_budget)
+        self.drain = drain
+        self.children = {}
+        self.stopping = False
+        self.drained = False
+        self._context = multiprocessing.get_context('fork')
+
+    def _stop(self, signum, frame):
+        if not self.stopping:
+            logger.info("Stopping after the packets being rendered")
+        self.stopping = True
+        for process in self.children.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+
+    def _spawn(self):
+        process = self._context.Process(target=work, args=self.worker_args, daemon=True)
+        process.start()
+        self.children[process.sentinel] = process
+
+    def _reap(self, sentinel):
+        process = self.children.pop(sentinel)
+        process.join()
+        if process.exitcode == EXIT_STOPPED:
+            # A worker only stops on its own when it found the queue empty
+            self.drained = self.drained or (self.drain and not self.stopping)
+        elif process.exitcode != EXIT_RECYCLED:
+            released = self.queue.release(worker_id(process.pid))
+            logger.error(f"Worker {process.pid} exited with {process.exitcode}; queued {released} job(s) again")
+
+    def warm_up(self):
+        """Render a small packet before forking, so every worker starts with warm caches"""
+        started = time.perf_counter()
+        build_pdf({'firstName': 'Warm', 'lastName': 'Up'}, list(DOCUMENT_TYPES), invariant=True)
+        logger.info(f"Warmed up in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    def run(self):
+        self.warm_up()
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        started = time.perf_counter()
+        reported_at = started
+        while True:
+            if not self.stopping and not self.drained:
+                while len(self.children) < self.processes:
+                    self._spawn()
+            if not self.children:
+                break
+            for sentinel in multiprocessing.connection.wait(list(self.children), timeout=1):
+                self._reap(sentinel)
+            if time.perf_counter() - reported_at >= PROGRESS_INTERVAL_SECONDS:
+                reported_at = time.perf_counter()
+                logger.info(f"Queue: {self.queue.counts()}")
+        counts = self.queue.counts()
+        logger.info(f"Stopped after {time.perf_counter() - started:.1f}s; queue: {counts}")
+        return counts
+
+def enqueue(queue, source, document_types):
+    """Queue a job per participant, keyed by participant id; returns how many were new"""
+    added = 0
+    batch = []
+    for participant_id, payload in source:
+        if document_types:
+            payload['documentTypes'] = document_types
+        batch.append((participant_id, payload))
+        if len(batch) >= ENQUEUE_BATCH_SIZE:
+            added += queue.put_many(batch)
+            batch = []
+    added += queue.put_many(batch)
+    return added
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_queue_arguments(command):
+        command.add_argument('--queue', required=True, help='sqlite:<path> or dir:<path>')
+        command.add_argument('--lease-seconds', type=float, default=DEFAULT_LEASE_SECONDS,
+                             help='how long a claimed job is held before another worker may take it')
+        command.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS)
+
+    enqueue_command = commands.add_parser('enqueue', help='queue a render job per participant')
+    add_queue_arguments(enqueue_command)
+    source_group = enqueue_command.add_mutually_exclusive_group(required=True)
+    source_group.add_argument('--jsonl', help='JSON Lines dump with one generatePDF payload per line')
+    source_group.add_argument('--supabase', action='store_true',
+                              help='read participants using SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY')
+    enqueue_command.add_argument('--document-types',
+                                 help='comma separated document types, replacing each payload\'s own')
+
+    run_command = commands.add_parser('run', help='render queued jobs with a prefork pool of workers')
+    add_queue_arguments(run_command)
+    output_group = run_command.add_mutually_exclusive_group(required=True)
+    output_group.add_argument('--output', help='directory to write <job id>.pdf files to')
+    output_group.add_argument('--artifacts', help='artifact store directory, e.g. the functions\' ARTIFACT_DIR; packets there are '
+                              'swept after ARTIFACT_RETENTION_SECONDS like any other artifact')
+    run_command.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    run_command.add_argument('--max-jobs-per-child', type=int, default=500,
+                             help='replace a worker after this many jobs; 0 never replaces them')
+    run_command.add_argument('--poll-interval', type=float, default=1.0,
+                             help='seconds an idle worker waits before looking for jobs again')
+    run_command.add_argument('--drain', action='store_true', help='stop once the queue is empty')
+    run_command.add_argument('--time-budget', type=float, default=MAX_RENDER_SECONDS,
+                             help='seconds one packet may take to render; 0 for no limit')
+
+    status_command = commands.add_parser('status', help='print how many jobs are in each state')
+    add_queue_arguments(status_command)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(process)d %(levelname)s %(message)s')
+    logger.setLevel(logging.INFO)
+    queue = open_queue(args.queue, lease_seconds=args.lease_seconds, max_attempts=args.max_attempts)
+
+    if args.command == 'status':
+        print(json.dumps(queue.counts()))
+        return 0
+
+    if args.command == 'enqueue':
+        if args.jsonl:
+            source = JsonlParticipantSource(args.jsonl)
+        else:
+            source = SupabaseParticipantSource(os.environ['SUPABASE_URL'], os.environ['SUPABASE_SERVICE_ROLE_KEY'])
+        document_types = [d.strip() for d in (args.document_types or '').split(',') if d.strip()]
+        added = enqueue(queue, source, document_types)
+        logger.info(f"Queued {added} new jobs; queue: {queue.counts()}")
+        return 0
+
+    if args.output:
+        output = DirectoryOutput(args.output)
+    else:
+        output = ArtifactOutput(LocalArtifactStore(args.artifacts))
+    supervisor = PreforkSupervisor(
+        queue,
+        output,
+        args.processes,
+        max_jobs_per_child=args.max_jobs_per_child,
+        poll_interval=args.poll_interval,
+        drain=args.drain,
+        time_budget=args.time_budget or None
+    )
+    counts = supervisor.run()
+    return 1 if counts['failed'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,913 @@
+"""Pure PDF packet renderer: request data in, PDF bytes out.
+
+Everything here is safe to call from a thread pool. Per-request state lives
+in local variables; the only module-level state is read-only (styles, table
+styles) or an internally locked cache (agreement templates, pre-rendered
+static agreement pages, logo, signature images).
+"""
+import logging
+import os
+import re
+import time
+from datetime import date, datetime, timezone
+from functools import lru_cache
+from io import BytesIO
+
+import markdown
+from reportlab.graphics.shapes import Drawing, Rect
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.platypus import Image, PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from flowables import DocumentStart, PdfOutput, StaticPage
+from legal_documents import create_template_cache
+from limits import RenderBudgetExceeded
+from metrics import PDF_ERRORS, PDF_PAGES, PDF_STAGE_SECONDS
+from packets import RenderedPacket, build_page_index
+from signatures import SIGNATURE_IMAGE_MAX_HEIGHT, SignatureImage, resolve_signature_images
+from static_pages import StaticPageCache, merge_static_pages, render_static_agreement
+
+# Add a helper function for safe markdown conversion
+def safe_markdown_to_html(md_content, default_message="Content could not be processed"):
+    """Safely convert markdown to HTML with proper error handling"""
+    try:
+        return markdown.markdown(md_content)
+    except Exception as e:
+        logging.error(f"Error converting markdown to HTML: {str(e)}")
+        return f"<p>{default_message}</p>"
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+AGREEMENTS_DIR = os.path.join(BASE_DIR, 'agreements')
+LOGO_PATH = os.path.join(BASE_DIR, 'logo.png')
+
+# Every document type build_elements knows how to render, in packet order
+DOCUMENT_TYPES = (
+    'intake_form',
+    'resident_as_guest',
+    'contract_terms',
+    'criminal_history',
+    'ethics',
+    'critical_rules',
+    'house_rules',
+    'digital_signature_consent',
+)
+
+# Shared styles - built once per worker instead of on every request
+styles = getSampleStyleSheet()
+DIGITAL_SIGNATURE_STYLE = ParagraphStyle(
+    'DigitalSignature',
+    parent=styles['Normal'],
+    alignment=1,  # Center alignment
+    fontSize=10,
+    textColor=colors.gray
+)
+
+# Agreement text comes from the versioned legal document source, see legal_documents.py
+template_cache = create_template_cache(AGREEMENTS_DIR)
+
+def load_agreement(document_type):
+    """Return the markdown of the active version of an agreement"""
+    return template_cache.get(document_type).content
+
+def load_agreement_html(document_type):
+    """Return the HTML of an agreement without per-resident placeholders, compiled once per version"""
+    return template_cache.get(document_type).html
+
+# Agreements whose text is the same for every resident (document type -> template);
+# packets copy their pages from a rendering made once per template version
+STATIC_AGREEMENTS = {
+    'contract_terms': 'contract_terms',
+    'ethics': 'ethics_agreement',
+    'critical_rules': 'critical_rules',
+    'house_rules': 'house_rules',
+}
+# Off by default: the merge re-parses and re-writes the whole packet, which leaves a busy
+# worker's RSS several MB higher on large packets (see benchmarks/memory_footprint.py)
+STATIC_AGREEMENT_PAGES = os.environ.get('STATIC_AGREEMENT_PAGES', 'false').lower() == 'true'
+# Equal requests give byte-identical packets, see render_packet
+DETERMINISTIC_BUILDS = os.environ.get('DETERMINISTIC_PDF_BUILDS', 'false').lower() == 'true'
+# "Generated on" for a deterministic packet with no signature or intake date; reportlab's invariant date
+DETERMINISTIC_EPOCH = datetime(2000, 1, 1, tzinfo=timezone.utc)
+# Room append_signature_footer can need: its two spacers, the largest signature image,
+# the gap below it and the date / signature ID text wrapped onto two lines
+SIGNATURE_FOOTER_HEIGHT = 20 + 20 + SIGNATURE_IMAGE_MAX_HEIGHT + 6 + 2 * DIGITAL_SIGNATURE_STYLE.leading
+PLACEHOLDER_PATTERN = re.compile(r'\[[A-Z_]+\]')
+
+def prerender_static_agreement(compiled):
+    """Render one version of an agreement for static_page_cache, or None if it has per-resident placeholders"""
+    if PLACEHOLDER_PATTERN.search(compiled.content):
+        return None
+    elements = []
+    append_agreement_html(elements, compiled.html)
+    logging.info(f"Pre-rendering {compiled.document_type} legal document version {compiled.version}")
+    return render_static_agreement(compiled.version, elements, SIGNATURE_FOOTER_HEIGHT, letter)
+
+static_page_cache = StaticPageCache(template_cache, prerender_static_agreement)
+
+def load_static_agreements(document_types):
+    """Map each static agreement among document_types to its pre-rendered pages.
+
+    An agreement that can not be pre-rendered is left out, and so laid out as
+    part of the packet as usual.
+    """
+    agreements = {}
+    for document_type in document_types:
+        template_name = STATIC_AGREEMENTS.get(document_type)
+        if template_name is None:
+            continue
+        try:
+            agreement = static_page_cache.get(template_name)
+        except Exception as e:
+            logging.error(f"Error pre-rendering {document_type}: {str(e)}")
+            PDF_ERRORS.inc(branch='static_pages')
+            continue
+        if agreement is not None:
+            agreements[document_type] = agreement
+    return agreements
+
+@lru_cache(maxsize=1)
+def load_logo():
+    """Read the logo once per worker, returning None when no logo is deployed"""
+    if not os.path.exists(LOGO_PATH):
+        return None
+    with open(LOGO_PATH, 'rb') as file:
+        return file.read()
+
+# Grid style shared by every history/list table
+HISTORY_TABLE_STYLE = TableStyle([
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('BACKGROUND', (0, 0), (-1, 0), colors.white),
+    ('TOPPADDING', (0, 0), (-1, -1), 6),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+])
+# 10pt text at the default 1.2 leading plus 6pt padding top and bottom
+HISTORY_TABLE_ROW_HEIGHT = 24
+HISTORY_TABLE_MIN_ROWS = 4
+
+def create_history_table(header, rows, col_widths):
+    """Build a list table that splits across pages with its header row repeated.
+
+    Column widths and row heights are fixed up front so reportlab does not have
+    to measure every cell, which keeps layout linear in the number of rows.
+    """
+    data = [header] + rows
+    while len(data) < HISTORY_TABLE_MIN_ROWS:
+        data.append([''] * len(header))
+
+    # Multi-line values need their rows measured, everything else gets a fixed height
+    if any('\n' in str(cell) for row in rows for cell in row):
+        row_heights = None
+    else:
+        row_heights = [HISTORY_TABLE_ROW_HEIGHT] * len(data)
+
+    table = Table(data, colWidths=col_widths, rowHeights=row_heights, repeatRows=1, splitByRow=1)
+    table.setStyle(HISTORY_TABLE_STYLE)
+    return table
+
+def create_recovery_residence_table(recovery_residences):
+    if not recovery_residences:
+        return None
+
+    rows = [[
+        residence.get('name', ''),
+        residence.get('startDate', ''),
+        residence.get('location', '')
+    ] for residence in recovery_residences]
+
+    return create_history_table(['Recovery Residence', 'Estimated Date', 'Location'], rows, [2.5*inch, 2*inch, 2*inch])
+
+def create_hospitalization_table(treatment_history):
+    rows = [[
+        treatment.get('type', ''),
+        treatment.get('estimatedDate', ''),
+        treatment.get('location', '')
+    ] for treatment in treatment_history or []]
+
+    return create_history_table(['Type', 'Estimated Date', 'Location'], rows, [2.5*inch, 2*inch, 2*inch])
+
+def create_incarceration_table(incarceration_history):
+    rows = [[
+        incarceration.get('type', ''),
+        incarceration.get('estimatedDate', ''),
+        incarceration.get('location', '')
+    ] for incarceration in incarceration_history or []]
+
+    return create_history_table(['Incarceration', 'Estimated Date', 'Location'], rows, [2.5*inch, 2*inch, 2*inch])
+
+def create_drug_screen_section(drug_test_results):
+    elements = []
+
+    def create_box(is_filled=False):
+        d = Drawing(15, 15)
+        d.add(Rect(1, 1, 13, 13, strokeWidth=0.75, strokeColor=colors.black, fillColor=colors.white))
+        if is_filled:
+            d.add(Rect(2.5, 2.5, 10, 10, strokeWidth=0, fillColor=colors.black))
+        return d
+
+    row1_tests = ['AMP', 'BAR', 'BUP', 'BZO', 'COC', 'mAMP', 'MDMA', 'MOP']
+    # Removed 'Invalid'
+    indicators = ['Neg -', 'Pos +']  # Removed 'Invalid'
+
+    test_data1 = [
+        row1_tests + indicators,  # Headers
+        [create_box(drug_test_results.get(test, False)) for test in row1_tests] + [
+            create_box(False),  # Neg box - Always empty
+            create_box(True),   # Pos box - Always filled
+        ]
+    ]
+
+    row2_tests = ['MTD', 'OXY', 'PCP', 'THC', 'ETG', 'FTY', 'TRA', 'K2']
+    test_data2 = [
+        row2_tests,
+        [create_box(drug_test_results.get(test, False)) for test in row2_tests]
+    ]
+
+    style = TableStyle([
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTSIZE', (0, 0), (-1, -1), 8),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 6),
+        ('TOPPADDING', (0, 1), (-1, 1), 6),
+        ('RIGHTPADDING', (0, 0), (-1, -1), 3),
+        ('LEFTPADDING', (0, 0), (-1, -1), 3),
+        ('VALIGN', (0, 0), (-1,-1), 'MIDDLE') # Vertically center everything
+    ])
+
+    col_width = 0.55*inch
+    # Adjusted column widths for indicators
+    table1 = Table(test_data1, colWidths=[col_width]*8 + [col_width*1.8, col_width*1.8])
+    table1.setStyle(style)
+
+    table2 = Table(test_data2, colWidths=[col_width]*8)
+    table2.setStyle(style)
+
+    elements.append(table1)
+    elements.append(Spacer(1, 8))
+    elements.append(table2)
+    elements.append(Spacer(1, 8))
+    elements.append(Paragraph("<b>Key:</b> Neg - = Negative Result, Pos + = Positive Result",
+                             ParagraphStyle('Key', fontSize=8, alignment=1)))  # Centered key
+
+
+    return elements
+
+def create_medication_table(medications, mat_medications=None):
+    """Create a table for medications with proper formatting."""
+    rows = []
+
+    # Add MAT medications if present
+    for med in mat_medications or []:
+        rows.append([
+            med.get('name', ''),
+            'MAT',
+            med.get('notes', '')
+        ])
+
+    # Add regular medications
+    for med in medications or []:
+        rows.append([
+            med.get('name', ''),
+            'Regular',
+            med.get('notes', '')
+        ])
+
+    return create_history_table(['Medication', 'Type', 'Notes'], rows, [2*inch, 1.5*inch, 3*inch])
+
+def create_authorized_people_table(authorized_people):
+    """Create a table for authorized people with proper formatting."""
+    rows = []
+    for person in authorized_people or []:
+        full_name = f"{person.get('firstName', '')} {person.get('lastName', '')}".strip()
+        rows.append([
+            full_name,
+            person.get('relationship', '').capitalize(),
+            person.get('phone', '')
+        ])
+
+    return create_history_table(['Name', 'Relationship', 'Phone'], rows, [2.5*inch, 2*inch, 2*inch])
+
+def format_signature_timestamp(signature_timestamp):
+    """Format an ISO signature timestamp for display, falling back to the raw value"""
+    if not signature_timestamp:
+        return ''
+    try:
+        sig_dt = datetime.fromisoformat(signature_timestamp.replace('Z', '+00:00'))
+        return sig_dt.strftime("%B %d, %Y at %I:%M:%S %p")
+    except Exception as e:
+        logging.warning(f"Error formatting signature timestamp: {str(e)}")
+        return signature_timestamp
+
+def append_agreement_html(elements, html):
+    """Append converted agreement HTML to the PDF, one paragraph per line"""
+    for line in html.split('\n'):
+        if line.strip():
+            if line.startswith('<h1>'):
+                elements.append(Paragraph(line[4:-5], styles['Title']))
+            elif line.startswith('<h2>'):
+                elements.append(Paragraph(line[4:-5], styles['Heading2']))
+            else:
+                elements.append(Paragraph(line, styles['Normal']))
+            elements.append(Spacer(1, 12))
+
+def append_signature_footer(elements, document_signature, req_body, signature_image=None):
+    """Append the signature image (if any) and the gray date / digital signature ID line that closes each agreement"""
+    # Add signature section with detailed timestamp
+    elements.append(Spacer(1, 20))
+
+    # Get current timestamp from document signature or general request body
+    signature_timestamp = document_signature.get('signatureTimestamp', req_body.get('signatureTimestamp', ''))
+    signature_id = document_signature.get('signatureId', req_body.get('signatureId', ''))
+    formatted_sig_time = format_signature_timestamp(signature_timestamp)
+
+    # Digital verification section - drawn signature when one was captured
+    elements.append(Spacer(1, 20))
+    if signature_image is not None:
+        elements.append(SignatureImage(signature_image))
+        elements.append(Spacer(1, 6))
+
+    # Combine date and digital signature ID on one line
+    if signature_id:
+        combined_text = f"Date: {formatted_sig_time}               Digital Signature ID: {signature_id}"
+        elements.append(Paragraph(combined_text, DIGITAL_SIGNATURE_STYLE))
+    else:
+        # If no signature ID, still show the date in gray
+        elements.append(Paragraph(f"Date: {formatted_sig_time}", DIGITAL_SIGNATURE_STYLE))
+
+def append_agreement(elements, template_name, document_signature, req_body, signature_image=None, static_agreement=None):
+    """Append an agreement followed by its signature footer.
+
+    With a static_agreement the agreement text is not laid out at all: its
+    pre-rendered pages are placed instead and only the footer is laid out, in
+    the region reserved for it, unless the footer would not fit there.
+    """
+    footer = []
+    append_signature_footer(footer, document_signature, req_body, signature_image)
+    if static_agreement is not None and static_agreement.fits(footer):
+        for index in range(static_agreement.stamp_page):
+            elements.append(StaticPage(static_agreement, index))
+        elements.append(StaticPage(static_agreement, static_agreement.stamp_page, static_agreement.stamp_offset))
+    else:
+        append_agreement_html(elements, load_agreement_html(template_name))
+    elements.extend(footer)
+
+def resolve_document_types(req_body):
+    """Return the requested document types with digital_signature_consent always last"""
+    # Support for multiple document types
+    document_types = list(req_body.get('documentTypes', []))
+    if not document_types:
+        # Backward compatibility - single document type
+        document_type = req_body.get('documentType', '')
+        if document_type:
+            document_types = [document_type]
+
+    # Add digital signature consent form if it's not already included
+    if 'digital_signature_consent' not in document_types:
+        # Ensuring it's the last document
+        document_types.append('digital_signature_consent')
+        logging.info(f"Added digital_signature_consent as the final document")
+    elif document_types[-1] != 'digital_signature_consent':
+        # If it's in the list but not at the end, remove it and append it again to ensure it's last
+        document_types.remove('digital_signature_consent')
+        document_types.append('digital_signature_consent')
+        logging.info(f"Moved digital_signature_consent to be the final document")
+
+    return document_types
+
+def build_elements(req_body, document_types, generated_at=None, static_agreements=None):
+    """Build the flowables for the requested document types.
+
+    This is the single definition of what a packet contains: render_packet lays
+    it out with reportlab and the preview route renders it straight to HTML.
+    generated_at is the time printed as "generated on" (default: now).
+    static_agreements (see load_static_agreements) places pre-rendered pages
+    for those agreements instead of their text.
+    """
+    generated_on = (generated_at or datetime.now()).strftime("%B %d, %Y at %I:%M:%S %p")
+
+    # Handle document-specific signatures
+    signatures = req_body.get('signatures', [])
+    # Create a dictionary to look up signatures by type
+    signature_map = {}
+    for sig in signatures:
+        sig_type = sig.get('signatureType', '')
+        if sig_type:
+            signature_map[sig_type] = sig
+
+    logging.info(f"Found {len(signatures)} signatures for {len(document_types)} document types")
+    logging.info(f"Signature types: {list(signature_map.keys())}")
+
+    # Decode each distinct signature image once for the whole packet
+    signature_images = resolve_signature_images(signatures)
+
+    # Common data
+    first_name = req_body.get('firstName', '')
+    last_name = req_body.get('lastName', '')
+    full_name = f"{first_name} {last_name}".strip()
+
+    elements = []
+
+    # Add logo if it exists
+    try:
+        logo = load_logo()
+        if logo:
+            elements.append(Image(BytesIO(logo), width=200, height=100))
+            elements.append(Spacer(1, 20))
+            logging.info("Added logo to PDF")
+    except Exception as e:
+        logging.warning(f"Error adding logo to PDF: {str(e)}")
+        PDF_ERRORS.inc(branch='logo')
+        # Continue without the logo, don't let this fail the PDF generation
+
+    # Process each document type
+    layout_started = time.perf_counter()
+    for i, document_type in enumerate(document_types):
+        logging.info(f"Processing document type: {document_type} ({i+1}/{len(document_types)})")
+
+        # Add a page break between documents (but not before the first one)
+        if i > 0:
+            elements.append(PageBreak())
+        elements.append(DocumentStart(document_type))
+        # Pre-rendered pages start at the top of a page, so the first document, which follows the logo, is laid out
+        static_agreement = static_agreements.get(document_type) if static_agreements and i > 0 else None
+
+        # Handle each document type
+        if document_type == 'intake_form':
+            try:
+                # Create full intake form PDF
+                logging.info("Generating full intake form PDF")
+
+                # Title and header info
+                elements.append(Paragraph("Journey House Intake Form", styles['Title']))
+                elements.append(Spacer(1, 12))
+
+                # Add client information section
+                elements.append(Paragraph("Resident Information", styles['Heading1']))
+                elements.append(Spacer(1, 6))
+
+                # Personal info table
+                personal_data = [
+                    ['Full Name:', f"{first_name} {last_name}", 'Intake Date:', req_body.get('intakeDate', '')],
+                    ['Date of Birth:', req_body.get('dateOfBirth', ''), 'SSN:', req_body.get('socialSecurityNumber', '')],
+                    ['Email:', req_body.get('email', ''), 'Phone:', req_body.get('phoneNumber', '')],
+                    ['Driver\'s License:', req_body.get('driversLicenseNumber', ''), 'Sex:', req_body.get('sex', '')]
+                ]
+
+                personal_table = Table(personal_data, colWidths=[1.5*inch, 2*inch, 1.5*inch, 2*inch])
+                personal_table.setStyle(TableStyle([
+                    ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+                    ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
+                    ('BACKGROUND', (2, 0), (2, -1), colors.lightgrey),
+                    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+                    ('FONTNAME', (2, 0), (2, -1), 'Helvetica-Bold'),
+                ]))
+                elements.append(personal_table)
+                elements.append(Spacer(1, 20))
+
+                # Add emergency contact section
+                elements.append(Paragraph("Emergency Contact", styles['Heading2']))
+                elements.append(Spacer(1, 6))
+
+                emergency_contact = req_body.get('emergencyContact') or {}
+                emergency_data = [
+                    ['Name:', f"{emergency_contact.get('firstName', '')} {emergency_contact.get('lastName', '')}"],
+                    ['Relationship:', emergency_contact.get('relationship', '')],
+                    ['Phone:', emergency_contact.get('phone', '')]
+                ]
+
+                emergency_table = Table(emergency_data, colWidths=[1.5*inch, 5.5*inch])
+                emergency_table.setStyle(TableStyle([
+                    ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+                    ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
+                    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+                ]))
+                elements.append(emergency_table)
+                elements.append(Spacer(1, 20))
+
+                # Add vehicle information if present
+                vehicle = req_body.get('vehicle', {})
+                if vehicle:
+                    elements.append(Paragraph("Vehicle Information", styles['Heading2']))
+                    elements.append(Spacer(1, 6))
+
+                    vehicle_data = [
+                        ['Make:', vehicle.get('make', '')],
+                        ['Model:', vehicle.get('model', '')],
+                        ['Tag Number:', vehicle.get('tagNumber', '')],
+                        ['Insured:', 'Yes' if vehicle.get('insured', False) else 'No']
+                    ]
+
+                    vehicle_table = Table(vehicle_data, colWidths=[1.5*inch, 5.5*inch])
+                    vehicle_table.setStyle(TableStyle([
+                        ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+                        ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
+                        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+                    ]))
+                    elements.append(vehicle_table)
+                    elements.append(Spacer(1, 20))
+
+                # Add medications table if present
+                medications = req_body.get('medications', [])
+                if medications and len(medications) > 0:
+                    elements.append(Paragraph("Medications", styles['Heading2']))
+                    elements.append(Spacer(1, 6))
+
+                    med_table = create_medication_table(medications)
+                    if med_table:
+                        elements.append(med_table)
+                        elements.append(Spacer(1, 20))
+
+                # Add authorized people section if present
+                authorized_people = req_body.get('authorizedPeople', [])
+                if authorized_people and len(authorized_people) > 0:
+                    elements.append(Paragraph("Authorized Individuals", styles['Heading2']))
+                    elements.append(Spacer(1, 6))
+
+                    auth_table = create_authorized_people_table(authorized_people)
+                    if auth_table:
+                        elements.append(auth_table)
+                        elements.append(Spacer(1, 20))
+
+                # Add health status section
+                health_status = req_body.get('healthStatus', {})
+                if health_status:
+                    elements.append(Paragraph("Health Status", styles['Heading2']))
+                    elements.append(Spacer(1, 6))
+
+                    # Create health condition boxes
+                    health_conditions = []
+                    if health_status.get('pregnant', False):
+                        health_conditions.append('Pregnant')
+                    if health_status.get('developmentallyDisabled', False):
+                        health_conditions.append('Developmentally Disabled')
+                    if health_status.get('coOccurringDisorder', False):
+                        health_conditions.append('Co-Occurring Disorder')
+                    if health_status.get('docSupervision', False):
+                        health_conditions.append('DOC Supervision')
+                    if health_status.get('felon', False):
+                        health_conditions.append('Felon')
+                    if health_status.get('physicallyHandicapped', False):
+                        health_conditions.append('Physically Handicapped')
+                    if health_status.get('postPartum', False):
+                        health_conditions.append('Post-Partum')
+                    if health_status.get('primaryFemaleCaregiver', False):
+                        health_conditions.append('Primary Female Caregiver')
+                    if health_status.get('recentlyIncarcerated', False):
+                        health_conditions.append('Recently Incarcerated')
+                    if health_status.get('sexOffender', False):
+                        health_conditions.append('Sex Offender')
+                    if health_status.get('lgbtq', False):
+                        health_conditions.append('LGBTQ+')
+                    if health_status.get('veteran', False):
+                        health_conditions.append('Veteran')
+                    if health_status.get('insulinDependent', False):
+                        health_conditions.append('Insulin Dependent')
+                    if health_status.get('historyOfSeizures', False):
+                        health_conditions.append('History of Seizures')
+
+                    health_conditions_text = ", ".join(health_conditions) if health_conditions else "None"
+
+                    health_data = [
+                        ['Health Conditions:', health_conditions_text],
+                        ['Race:', health_status.get('race', '')],
+                        ['Ethnicity:', health_status.get('ethnicity', '')],
+                        ['Household Income:', health_status.get('householdIncome', '')],
+                        ['Employment Status:', health_status.get('employmentStatus', '')]
+                    ]
+
+                    health_table = Table(health_data, colWidths=[1.5*inch, 5.5*inch])
+                    health_table.setStyle(TableStyle([
+                        ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+                        ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
+                        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+                    ]))
+                    elements.append(health_table)
+                    elements.append(Spacer(1, 20))
+
+                # Add signatures section
+                elements.append(Paragraph("Signatures", styles['Heading2']))
+                elements.append(Spacer(1, 6))
+
+                signature = signature_map.get(document_type, {})
+                if signature:
+                    sig_type = signature.get('signatureType', '')
+                    formatted_date = format_signature_timestamp(signature.get('signatureTimestamp', ''))
+
+                    # Create display name for signature type
+                    sig_type_display = sig_type.replace('_', ' ').title()
+
+                    elements.append(Paragraph(f"{sig_type_display} Agreement", styles['Heading3']))
+                    if document_type in signature_images:
+                        elements.append(SignatureImage(signature_images[document_type]))
+                    elements.append(Paragraph(f"Signed on: {formatted_date}", styles['Normal']))
+                    elements.append(Spacer(1, 12))
+
+                elements.append(Spacer(1, 20))
+                elements.append(Paragraph("Generated on: " + generated_on, styles['Normal']))
+
+                # Add page break after intake form
+                elements.append(PageBreak())
+            except Exception as e:
+                logging.error(f"Error generating intake form PDF: {str(e)}")
+                PDF_ERRORS.inc(branch='intake_form')
+                elements.append(Paragraph("Journey House Intake Form", styles['Title']))
+                elements.append(Spacer(1, 12))
+                elements.append(Paragraph(f"Error generating intake form: {str(e)}", styles['Normal']))
+                elements.append(Spacer(1, 12))
+                elements.append(Paragraph("Please contact support for assistance.", styles['Normal']))
+                elements.append(PageBreak())  # Add page break even after error
+
+        elif document_type == 'resident_as_guest':
+            # Read and process the resident as guest agreement
+            try:
+                content = load_agreement('resident_as_guest')
+                # Replace the resident name placeholder
+                content = content.replace('[RESIDENT_NAME]', full_name)
+
+                # Convert markdown to HTML using safe function
+                html = safe_markdown_to_html(content, f"Error processing resident as guest agreement for {full_name}")
+                append_agreement_html(elements, html)
+                append_signature_footer(elements, signature_map.get(document_type, {}), req_body, signature_images.get(document_type))
+                # Don't add page break at the end of the loop, it will be handled by the loop
+            except Exception as e:
+                logging.error(f"Error processing resident_as_guest document: {str(e)}")
+                PDF_ERRORS.inc(branch='resident_as_guest')
+                elements.append(Paragraph("Resident as Guest Agreement", styles['Title']))
+                elements.append(Spacer(1, 12))
+                elements.append(Paragraph(f"Error rendering agreement: {str(e)}", styles['Normal']))
+                # Don't add page break at the end of the loop, it will be handled by the loop
+
+        elif document_type == 'contract_terms':
+            # Read and process the contract terms
+            try:
+                append_agreement(
+                    elements, 'contract_terms', signature_map.get(document_type, {}), req_body,
+                    signature_images.get(document_type), static_agreement
+                )
+                # Don't add page break at the end of the loop, it will be handled by the loop
+            except Exception as e:
+                logging.error(f"Error processing contract_terms document: {str(e)}")
+                PDF_ERRORS.inc(branch='contract_terms')
+                elements.append(Paragraph(f"Error rendering contract terms: {str(e)}", styles['Normal']))
+                # Don't add page break at the end of the loop, it will be handled by the loop
+
+        elif document_type == 'criminal_history':
+            # Read and process the criminal history template
+            try:
+                content = load_agreement('criminal_history')
+                legal_status_data = req_body.get('legalStatus') or {}
+
+                # Create Legal Status Summary
+                legal_status = []
+                if legal_status_data.get('hasPendingCharges'):
+                    legal_status.append("- Currently has pending charges")
+                if legal_status_data.get('hasConvictions'):
+                    legal_status.append("- Has prior convictions")
+                if legal_status_data.get('isWanted'):
+                    legal_status.append("- Currently wanted by law enforcement")
+                if legal_status_data.get('isOnBond'):
+                    bondsman = legal_status_data.get('bondsmanName', '')
+                    legal_status.append(f"- Currently out on bond (Bondsman: {bondsman})")
+
+                if not legal_status:
+                    legal_status = ["Has no pending charges or convictions."]
+
+                content = content.replace('[LEGAL_STATUS_SUMMARY]', '\n'.join(legal_status))
+
+                # Create Pending Charges Section
+                pending_charges = req_body.get('pendingCharges', [])
+                if pending_charges and legal_status_data.get('hasPendingCharges'):
+                    charges_text = []
+                    for i, charge in enumerate(pending_charges, 1):
+                        desc = charge.get('chargeDescription', '').strip()
+                        loc = charge.get('location', '').strip()
+                        charges_text.append(f"{i}. {desc} (Location: {loc if loc else 'Not specified'})")
+                    pending_charges_text = '\n'.join(charges_text)
+                else:
+                    pending_charges_text = "No pending charges."
+
+                content = content.replace('[PENDING_CHARGES]', pending_charges_text)
+
+                # Create Convictions Section
+                convictions = req_body.get('convictions', [])
+                if convictions and legal_status_data.get('hasConvictions'):
+                    convictions_text = []
+                    for i, conviction in enumerate(convictions, 1):
+                        offense = conviction.get('offense', '').strip()
+                        convictions_text.append(f"{i}. {offense}")
+                    convictions_text = '\n'.join(convictions_text)
+                else:
+                    convictions_text = "No convictions."
+
+                content = content.replace('[CONVICTIONS]', convictions_text)
+
+                # Handle additional information section if it exists in the template
+                if '[ADDITIONAL_INFORMATION]' in content:
+                    additional_info = legal_status_data.get('additionalInformation', '').strip()
+                    if not additional_info:
+                        additional_info = "No additional information."
+                    content = content.replace('[ADDITIONAL_INFORMATION]', additional_info)
+
+                # Replace the resident name placeholder
+                content = content.replace('[RESIDENT_NAME]', full_name)
+
+                # Convert markdown to HTML
+                append_agreement_html(elements, markdown.markdown(content))
+                append_signature_footer(elements, signature_map.get(document_type, {}), req_body, signature_images.get(document_type))
+                # Don't add page break at the end of the loop, it will be handled by the loop
+            except Exception as e:
+                logging.error(f"Error processing criminal_history document: {str(e)}")
+                PDF_ERRORS.inc(branch='criminal_history')
+                elements.append(Paragraph("Criminal History Disclosure", styles['Title']))
+                elements.append(Spacer(1, 12))
+                elements.append(Paragraph(f"Error rendering criminal history disclosure: {str(e)}", styles['Normal']))
+                # Don't add page break at the end of the loop, it will be handled by the loop
+
+        elif document_type == 'ethics':
+            # Read and process the ethics agreement
+            try:
+                append_agreement(
+                    elements, 'ethics_agreement', signature_map.get(document_type, {}), req_body,
+                    signature_images.get(document_type), static_agreement
+                )
+                # Don't add page break at the end of the loop, it will be handled by the loop
+            except Exception as e:
+                logging.error(f"Error processing ethics document: {str(e)}")
+                PDF_ERRORS.inc(branch='ethics')
+                elements.append(Paragraph("Ethics Agreement", styles['Title']))
+                elements.append(Spacer(1, 12))
+                elements.append(Paragraph(f"Error rendering ethics agreement: {str(e)}", styles['Normal']))
+                # Don't add page break at the end of the loop, it will be handled by the loop
+
+        elif document_type == 'critical_rules':
+            # Read and process the critical rules
+            try:
+                append_agreement(
+                    elements, 'critical_rules', signature_map.get(document_type, {}), req_body,
+                    signature_images.get(document_type), static_agreement
+                )
+                # Don't add page break at the end of the loop, it will be handled by the loop
+            except Exception as e:
+                logging.error(f"Error processing critical_rules document: {str(e)}")
+                PDF_ERRORS.inc(branch='critical_rules')
+                elements.append(Paragraph("Critical Rules Agreement", styles['Title']))
+                elements.append(Spacer(1, 12))
+                elements.append(Paragraph(f"Error rendering critical rules agreement: {str(e)}", styles['Normal']))
+                # Don't add page break at the end of the loop, it will be handled by the loop
+
+        elif document_type == 'house_rules':
+            # Read and process the house rules
+            try:
+                append_agreement(
+                    elements, 'house_rules', signature_map.get(document_type, {}), req_body,
+                    signature_images.get(document_type), static_agreement
+                )
+                # Don't add page break at the end of the loop, it will be handled by the loop
+            except Exception as e:
+                logging.error(f"Error processing house_rules document: {str(e)}")
+                PDF_ERRORS.inc(branch='house_rules')
+                elements.append(Paragraph("House Rules Agreement", styles['Title']))
+                elements.append(Spacer(1, 12))
+                elements.append(Paragraph(f"Error rendering house rules agreement: {str(e)}", styles['Normal']))
+                # Don't add page break at the end of the loop, it will be handled by the loop
+
+        elif document_type == 'digital_signature_consent':
+            # Read and process the digital signature consent
+            try:
+                content = load_agreement('digital_signature_consent')
+
+                # Replace the resident name placeholder
+                content = content.replace('[RESIDENT_NAME]', full_name)
+
+                # Convert markdown to HTML
+                append_agreement_html(elements, markdown.markdown(content))
+
+                # Add signature section with detailed timestamp - current date
+                elements.append(Spacer(1, 20))
+                elements.append(Paragraph(f"Document generated on: {generated_on}", DIGITAL_SIGNATURE_STYLE))
+            except Exception as e:
+                logging.error(f"Error processing digital_signature_consent document: {str(e)}")
+                PDF_ERRORS.inc(branch='digital_signature_consent')
+                elements.append(Paragraph("Digital Signature Consent", styles['Title']))
+                elements.append(Spacer(1, 12))
+                elements.append(Paragraph(f"Error rendering digital signature consent: {str(e)}", styles['Normal']))
+                # Don't add page break at the end, this is the last document
+        else:
+            # Handle unknown document type
+            logging.warning(f"Unknown document type: {document_type}")
+            elements.append(Paragraph(f"Unknown Document Type: {document_type}", styles['Title']))
+            elements.append(Spacer(1, 12))
+            elements.append(Paragraph(f"The requested document type '{document_type}' is not recognized.", styles['Normal']))
+            elements.append(Spacer(1, 12))
+            elements.append(Paragraph("Please contact support if you believe this is an error.", styles['Normal']))
+            # Don't add page break at the end, it will be handled by the loop
+
+    PDF_STAGE_SECONDS.observe(time.perf_counter() - layout_started, stage='flowables')
+    return elements
+
+class PacketDocTemplate(SimpleDocTemplate):
+    """SimpleDocTemplate that records the page each document of the packet starts on.
+
+    It also records the page every StaticPage placeholder lands on, for
+    merge_static_pages. With a deadline (a time.monotonic() value), layout is abandoned with
+    RenderBudgetExceeded at the first flowable placed after it.
+    """
+
+    def __init__(self, *args, deadline=None, **kwargs):
+        SimpleDocTemplate.__init__(self, *args, **kwargs)
+        self.document_starts = []
+        self.static_placements = []
+        self.deadline = deadline
+
+    def afterFlowable(self, flowable):
+        if isinstance(flowable, DocumentStart):
+            self.document_starts.append((flowable.document_type, self.page))
+        elif isinstance(flowable, StaticPage):
+            self.static_placements.append((self.page, flowable.agreement, flowable.index))
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise RenderBudgetExceeded(f"Rendering stopped on page {self.page} after exceeding its time budget")
+
+def deterministic_generated_at(req_body):
+    """The "generated on" time of a deterministic build, taken from the packet itself.
+
+    That is when it was last signed, failing that its intake date, failing
+    that DETERMINISTIC_EPOCH, so the same packet always prints the same time.
+    """
+    signed_at = []
+    for sig in req_body.get('signatures') or []:
+        try:
+            timestamp = datetime.fromisoformat(str(sig.get('signatureTimestamp')).replace('Z', '+00:00'))
+        except ValueError:
+            continue
+        signed_at.append(timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=timezone.utc))
+    if signed_at:
+        return max(signed_at)
+    try:
+        intake_date = date.fromisoformat(str(req_body.get('intakeDate'))[:10])
+    except ValueError:
+        return DETERMINISTIC_EPOCH
+    return datetime(intake_date.year, intake_date.month, intake_date.day, tzinfo=timezone.utc)
+
+def render_packet(req_body, document_types, generated_at=None, invariant=False, time_budget=None,
+                  static_pages=STATIC_AGREEMENT_PAGES, deterministic=DETERMINISTIC_BUILDS):
+    """Render the requested document types into a RenderedPacket with its page index.
+
+    The result depends only on the arguments (and the active template
+    versions); with a fixed generated_at and invariant=True, which stops
+    reportlab stamping the current time and a random ID into the file, equal
+    inputs give byte-identical PDFs. deterministic sets both, generated_at
+    from the packet (see deterministic_generated_at). time_budget caps the
+    seconds spent rendering, see PacketDocTemplate. static_pages copies the
+    pages of static agreements from their pre-rendered versions instead of
+    laying them out.
+    """
+    if deterministic:
+        generated_at = generated_at or deterministic_generated_at(req_body)
+        invariant = True
+    deadline = time.monotonic() + time_budget if time_budget else None
+    static_agreements = load_static_agreements(document_types) if static_pages else None
+    # doc.build pops each flowable off this list as it places it, so nothing else may hold on to
+    # them: they are released page by page rather than when the render returns. Building them
+    # a document at a time as layout goes measured no lower at peak and fragmented the heap.
+    elements = build_elements(req_body, document_types, generated_at, static_agreements)
+
+    # Set up the document
+    output = PdfOutput()
+    doc = PacketDocTemplate(output, pagesize=letter, invariant=1 if invariant else None, deadline=deadline)
+
+    # Before building the PDF
+    logging.info(f"Number of elements to be added to PDF: {len(elements)}")
+
+    # Build the PDF
+    try:
+        logging.info("Starting PDF build process")
+        build_started = time.perf_counter()
+        doc.build(elements)
+        PDF_STAGE_SECONDS.observe(time.perf_counter() - build_started, stage='build')
+        pdf_bytes = output.data
+        if doc.static_placements:
+            merge_started = time.perf_counter()
+            pdf_bytes = merge_static_pages(pdf_bytes, doc.static_placements)
+            PDF_STAGE_SECONDS.observe(time.perf_counter() - merge_started, stage='merge')
+        PDF_PAGES.observe(doc.page)
+        logging.info("PDF build process completed successfully")
+    except RenderBudgetExceeded as e:
+        logging.error(f"PDF build abandoned: {str(e)}")
+        PDF_ERRORS.inc(branch='budget')
+        raise
+    except Exception as e:
+        logging.error(f"Error during PDF build: {str(e)}")
+        PDF_ERRORS.inc(branch='build')
+        import traceback
+        logging.error(f"PDF build traceback: {traceback.format_exc()}")
+        raise
+
+    return RenderedPacket(pdf_bytes, doc.page, build_page_index(doc.document_starts, doc.page))
+
+def build_pdf(req_body, document_types, generated_at=None, invariant=False):
+    """Render the requested document types into a single PDF and return its bytes"""
+    return render_packet(req_body, document_types, generated_at, invariant).pdf_bytes
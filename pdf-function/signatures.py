@@ -0,0 +1,152 @@
+import base64
+import binascii
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from reportlab.lib.units import inch
+from reportlab.lib.utils import ImageReader
+from reportlab.platypus import Flowable
+
+SIGNATURE_IMAGE_MAX_WIDTH = 2.5*inch
+SIGNATURE_IMAGE_MAX_HEIGHT = 0.75*inch
+
+def decode_signature_image(value):
+    """Return the raw image bytes of a data URL signature, or None for typed signatures"""
+    if not isinstance(value, str) or not value.startswith('data:image/'):
+        return None
+    header, _, encoded = value.partition(',')
+    if not header.endswith(';base64') or not encoded:
+        return None
+    try:
+        return base64.b64decode(encoded, validate=True)
+    except (binascii.Error, ValueError) as e:
+        logging.warning(f"Could not decode signature image: {str(e)}")
+        return None
+
+# Fields of a signature entry that may carry a data URL image
+SIGNATURE_IMAGE_FIELDS = ('signature', 'signatureImage', 'witnessSignature')
+
+def share_signature_images(signatures):
+    """Make every repeat of a signature image in a parsed request the same string object.
+
+    The form sends one signature entry per document, usually with the same
+    drawn image in each, and json.loads gives every occurrence its own copy;
+    a packet of eight documents would otherwise hold eight copies of the image
+    for as long as the request is alive.
+    """
+    if not isinstance(signatures, list):
+        return
+    shared = {}
+    for sig in signatures:
+        if not isinstance(sig, dict):
+            continue
+        for field in SIGNATURE_IMAGE_FIELDS:
+            value = sig.get(field)
+            if isinstance(value, str) and value.startswith('data:image/'):
+                sig[field] = shared.setdefault(value, value)
+
+class SignatureImageReader(ImageReader):
+    """ImageReader that keeps the encoded image, so HTML previews can embed it as-is"""
+
+    def __init__(self, raw):
+        ImageReader.__init__(self, BytesIO(raw))
+        self.raw = raw
+
+class SignatureImageCache:
+    """Thread-safe LRU of decoded signature images keyed by the SHA-256 of their data URL, shared across requests"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+signature_image_cache = SignatureImageCache(int(os.environ.get('SIGNATURE_CACHE_SIZE', '256')))
+
+def resolve_signature_images(signatures, cache=signature_image_cache):
+    """Map signatureType to a shared ImageReader for every signature that carries an image.
+
+    Each image is decoded at most once per request: entries are looked up in
+    the cross-request cache by the SHA-256 of the data URL the request itself
+    carries (never by the client-chosen signatureId, which would let one
+    request pick up another's image), and identical images (by SHA-256 of
+    their bytes) share one ImageReader, so reportlab embeds a single image
+    object however many documents the signature appears on.
+    """
+    readers_by_digest = {}
+    entries_by_value = {}
+    images = {}
+    for sig in signatures:
+        sig_type = sig.get('signatureType', '')
+        if not sig_type:
+            continue
+        value = sig.get('signatureImage') or sig.get('signature')
+        if not isinstance(value, str) or not value.startswith('data:image/'):
+            continue
+
+        # The same image usually repeats on every document; hash its data URL once per request
+        entry = entries_by_value.get(value)
+        if entry is None:
+            key = hashlib.sha256(value.encode('utf-8')).hexdigest()
+            entry = cache.get(key)
+            if entry is None:
+                raw = decode_signature_image(value)
+                if raw is None:
+                    continue
+                entry = (hashlib.sha256(raw).hexdigest(), raw)
+                cache.put(key, entry)
+            entries_by_value[value] = entry
+
+        digest, raw = entry
+        reader = readers_by_digest.get(digest)
+        if reader is None:
+            try:
+                reader = SignatureImageReader(raw)
+            except Exception as e:
+                logging.warning(f"Unreadable signature image for {sig_type}: {str(e)}")
+                continue
+            readers_by_digest[digest] = reader
+        images[sig_type] = reader
+
+    logging.info(f"Resolved {len(images)} signature images ({len(readers_by_digest)} unique)")
+    return images
+
+class SignatureImage(Flowable):
+    """Draw a shared ImageReader scaled to fit the signature box, keeping its aspect ratio"""
+
+    def __init__(self, reader, max_width=SIGNATURE_IMAGE_MAX_WIDTH, max_height=SIGNATURE_IMAGE_MAX_HEIGHT):
+        Flowable.__init__(self)
+        self.reader = reader
+        image_width, image_height = reader.getSize()
+        scale = min(max_width / image_width, max_height / image_height)
+        self.width = image_width * scale
+        self.height = image_height * scale
+        self.hAlign = 'CENTER'
+
+    def wrap(self, availWidth, availHeight):
+        return self.width, self.height
+
+    def draw(self):
+        self.canv.drawImage(self.reader, 0, 0, width=self.width, height=self.height, mask='auto')
@@ -0,0 +1,131 @@
+"""Pre-rendered pages for agreements that read the same for every resident.
+
+Most of a packet is agreement text that only changes when its template does;
+what differs from one resident to the next is the signature footer that
+closes each agreement. Such an agreement is laid out once per template
+version with a StampRegion reserved where its footer goes, and the result
+is kept as a small PDF.
+
+When a packet includes it, build_elements puts one StaticPage placeholder
+per cached page into the layout in place of the agreement text, and lays out
+only the footer, at the spot the region was reserved. merge_static_pages then
+draws each cached page, as a form XObject, beneath the packet page its
+placeholder landed on. Its content and fonts are copied over untouched, so
+nothing needs parsing or renaming, and the packet's own pages (with the
+footer stamp) keep theirs.
+"""
+import threading
+from io import BytesIO
+
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import ArrayObject, DecodedStreamObject, DictionaryObject, NameObject
+from reportlab.platypus import SimpleDocTemplate
+
+from flowables import PdfOutput, StampRegion
+
+class StaticAgreement:
+    """One template version of an agreement, rendered, and where its stamp region is.
+
+    The region starts stamp_offset points below the top of the frame on page
+    stamp_page (0-based) and is stamp_height high and width wide.
+    """
+    __slots__ = ('version', 'pdf_bytes', 'reader', 'lock', 'stamp_page', 'stamp_offset', 'stamp_height', 'width')
+
+    def __init__(self, version, pdf_bytes, stamp_page, stamp_offset, stamp_height, width):
+        self.version = version
+        self.pdf_bytes = pdf_bytes
+        # Parsed once per version and shared by every merge; a pypdf reader is not thread-safe
+        self.reader = PdfReader(BytesIO(pdf_bytes))
+        self.lock = threading.Lock()
+        self.stamp_page = stamp_page
+        self.stamp_offset = stamp_offset
+        self.stamp_height = stamp_height
+        self.width = width
+
+    def fits(self, footer):
+        """True when the footer flowables fit in the stamp region, e.g. the signature ID does not wrap too far"""
+        height = 0
+        for flowable in footer:
+            height += flowable.wrap(self.width, self.stamp_height)[1]
+        return height <= self.stamp_height
+
+def render_static_agreement(version, elements, stamp_height, pagesize):
+    """Lay out an agreement's elements followed by a stamp region into a StaticAgreement"""
+    region = StampRegion(stamp_height)
+    output = PdfOutput()
+    # Same frame as PacketDocTemplate, so the cached pages line up with the packet's
+    doc = SimpleDocTemplate(output, pagesize=pagesize, invariant=1)
+    doc.build(list(elements) + [region])
+    frame = doc.pageTemplates[0].frames[0]
+    frame_top = frame.y1 + frame.height - frame.topPadding
+    return StaticAgreement(
+        version, output.data, region.page - 1, frame_top - region.top, stamp_height, region.width
+    )
+
+class StaticPageCache:
+    """Static agreements rendered once per template version, shared across requests.
+
+    render(compiled_template) returns a StaticAgreement, or None for a template
+    that varies per resident (that version is then always laid out).
+    """
+
+    def __init__(self, template_cache, render):
+        self.template_cache = template_cache
+        self.render = render
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, template_name):
+        """Return the StaticAgreement for the active version of template_name, or None"""
+        compiled = self.template_cache.get(template_name)
+        entry = self._entries.get(template_name)
+        if entry is not None and entry[0] == compiled.version:
+            self.hits += 1
+            return entry[1]
+        with self._lock:
+            entry = self._entries.get(template_name)
+            if entry is not None and entry[0] == compiled.version:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            agreement = self.render(compiled)
+            # Replaces (and so releases) the pages of the previously active version
+            self._entries[template_name] = (compiled.version, agreement)
+            return agreement
+
+def merge_static_pages(pdf_bytes, placements):
+    """Draw cached agreement pages beneath the packet pages their placeholders landed on.
+
+    placements are (page_number, StaticAgreement, index) for every StaticPage
+    placed. The packet's own objects, info and ID are kept as reportlab wrote them.
+    """
+    packet_reader = PdfReader(BytesIO(pdf_bytes))
+    writer = PdfWriter()
+    writer.clone_document_from_reader(packet_reader)
+    for page_number, agreement, index in placements:
+        with agreement.lock:
+            static_page = agreement.reader.pages[index]
+            form = static_page['/Contents'].get_object().clone(writer)
+            form[NameObject('/Type')] = NameObject('/XObject')
+            form[NameObject('/Subtype')] = NameObject('/Form')
+            form[NameObject('/BBox')] = ArrayObject(static_page.mediabox)
+            form[NameObject('/Resources')] = static_page['/Resources'].clone(writer)
+
+        page = writer.pages[page_number - 1]
+        # Fresh dicts, as reportlab may share resource dicts between pages
+        resources = DictionaryObject(page['/Resources'].get_object())
+        page[NameObject('/Resources')] = resources
+        xobjects = DictionaryObject(resources['/XObject'].get_object()) if '/XObject' in resources else DictionaryObject()
+        name = NameObject(f"/StaticPage{page_number}")
+        xobjects[name] = form.indirect_reference
+        resources[NameObject('/XObject')] = xobjects
+        # The packet page holds at most the footer stamp, so rewriting its content is cheap
+        contents = DecodedStreamObject()
+        contents.set_data(f"q {name} Do Q\n".encode('ascii') + page['/Contents'].get_data())
+        page.replace_contents(contents.flate_encode())
+
+    output = BytesIO()
+    writer.write(output)
+    return output.getvalue()
@@ -0,0 +1,34 @@
+import logging
+import json
+import azure.functions as func
+
+from ..shared_code.applications import InvalidQuery, list_applications, parse_page_size
+from ..shared_code.db import get_connection
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed a request.')
+    try:
+        applications, next_cursor = list_applications(
+            get_connection(),
+            page_size=parse_page_size(req.params.get('limit')),
+            cursor=req.params.get('cursor'),
+            housing_location=req.params.get('housingLocation'),
+            created_from=req.params.get('createdFrom'),
+            created_to=req.params.get('createdTo')
+        )
+        return func.HttpResponse(
+            json.dumps({"applications": applications, "nextCursor": next_cursor}),
+            mimetype="application/json"
+        )
+    except InvalidQuery as e:
+        return func.HttpResponse(
+            json.dumps({"success": False, "message": str(e)}),
+            status_code=400,
+            mimetype="application/json"
+        )
+    except Exception as e:
+        return func.HttpResponse(
+            json.dumps({"success": False, "message": "Failed to list applications", "error": str(e)}),
+            status_code=500,
+            mimetype="application/json"
+        )
\ No newline at end of file
@@ -1,6 +1,7 @@
 // Now that we're using standard Next.js deployment, this API route can proxy requests to the Azure Function
 
 import { NextRequest, NextResponse } from 'next/server';
+import { gzipSync } from 'zlib';
 
 // Enable dynamic API routes
 export const dynamic = 'force-dynamic';
@@ -15,16 +16,35 @@ export async function POST(request: NextRequest) {
   try {
     // Get the request body
     const body = await request.json();
+    const ifNoneMatch = request.headers.get('If-None-Match');
     
-    // Forward the request to the Azure Function
+    // Forward the request to the Azure Function, gzipped since signature images make payloads large.
+    // fetch negotiates and decodes a compressed response on its own.
     const response = await fetch(PDF_FUNCTION_URL, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
-        'X-Request-ID': request.headers.get('X-Request-ID') || `pdf-${Date.now()}`
+        'Content-Encoding': 'gzip',
+        'X-Request-ID': request.headers.get('X-Request-ID') || `pdf-${Date.now()}`,
+        // Lets the function answer 304 when the browser already has this packet
+        ...(ifNoneMatch ? { 'If-None-Match': ifNoneMatch } : {})
       },
-      body: JSON.stringify(body)
+      body: gzipSync(JSON.stringify(body))
     });
+
+    // Validators for the packet, passed back so the browser can revalidate it next time
+    const cacheHeaders: Record<string, string> = {};
+    for (const name of ['ETag', 'Cache-Control']) {
+      const value = response.headers.get(name);
+      if (value) {
+        cacheHeaders[name] = value;
+      }
+    }
+
+    // The browser's copy is still current; a 304 has no body
+    if (response.status === 304) {
+      return new NextResponse(null, { status: 304, headers: cacheHeaders });
+    }
     
     // If the function returned an error, pass it through
     if (!response.ok) {
@@ -42,6 +62,13 @@ export async function POST(request: NextRequest) {
       );
     }
     
+    // With URL delivery the function returns a signed link instead of the bytes;
+    // redirect so the browser downloads the PDF straight from storage
+    if (response.headers.get('Content-Type')?.startsWith('application/json')) {
+      const { url } = await response.json();
+      return NextResponse.redirect(url, 303);
+    }
+
     // Get the PDF data
     const blob = await response.blob();
     const buffer = await blob.arrayBuffer();
@@ -56,7 +83,8 @@ export async function POST(request: NextRequest) {
         headers: {
           'Content-Type': 'application/pdf',
           'Content-Disposition': `attachment; filename="GeneratedIntake.pdf"`,
-          'Content-Length': buffer.byteLength.toString()
+          'Content-Length': buffer.byteLength.toString(),
+          ...cacheHeaders
         }
       }
     );
@@ -0,0 +1,35 @@
+import logging
+import json
+import azure.functions as func
+
+from ..shared_code.db import get_connection
+from ..shared_code.search_index import DEFAULT_RESULT_LIMIT, MAX_QUERY_LENGTH, MAX_RESULT_LIMIT, get_search_service
+
+# Start building the index as soon as the worker loads the function, not on the first search
+get_search_service().start()
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed a request.')
+    query = (req.params.get('q') or '').strip()
+    try:
+        limit = int(req.params.get('limit') or DEFAULT_RESULT_LIMIT)
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= MAX_RESULT_LIMIT or len(query) > MAX_QUERY_LENGTH:
+        return func.HttpResponse(
+            json.dumps({"success": False, "message": f"limit must be between 1 and {MAX_RESULT_LIMIT} and q at most {MAX_QUERY_LENGTH} characters"}),
+            status_code=400,
+            mimetype="application/json"
+        )
+    try:
+        results = get_search_service().search(get_connection(), query, limit) if query else []
+        return func.HttpResponse(
+            json.dumps({"participants": [record.to_json() for record in results]}),
+            mimetype="application/json"
+        )
+    except Exception as e:
+        return func.HttpResponse(
+            json.dumps({"success": False, "message": "Failed to search participants", "error": str(e)}),
+            status_code=500,
+            mimetype="application/json"
+        )
\ No newline at end of file
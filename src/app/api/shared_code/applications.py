@@ -0,0 +1,110 @@
+"""Keyset-paginated listing of participants for the admin applications page.
+
+Pages are ordered newest first by (created_at, id). Each page starts where the
+previous one ended rather than at an OFFSET, so the query is an index range
+scan on idx_participants_created_at that reads only the rows it returns,
+however deep the page is. Participants without a created_at come after all
+the others, by id.
+"""
+import base64
+import binascii
+import json
+from datetime import date, datetime
+
+# Only the columns the applications list shows
+LIST_COLUMNS = (
+    'id', 'first_name', 'last_name', 'intake_date', 'housing_location', 'email', 'phone_number', 'created_at'
+)
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+class InvalidQuery(ValueError):
+    pass
+
+def encode_cursor(created_at, participant_id):
+    raw = json.dumps([created_at.isoformat() if created_at else None, str(participant_id)]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, participant_id = json.loads(raw)
+        return (datetime.fromisoformat(created_at) if created_at is not None else None), participant_id
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidQuery("Invalid cursor")
+
+def _parse_datetime(value, name):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise InvalidQuery(f"{name} must be an ISO 8601 date or timestamp")
+
+def parse_page_size(value):
+    if value is None or value == '':
+        return DEFAULT_PAGE_SIZE
+    try:
+        page_size = int(value)
+    except ValueError:
+        raise InvalidQuery("limit must be an integer")
+    if not 1 <= page_size <= MAX_PAGE_SIZE:
+        raise InvalidQuery(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return page_size
+
+def _fetch(conn, conditions, params, order_by, limit):
+    sql = (
+        f"SELECT {', '.join(LIST_COLUMNS)} FROM participants WHERE {' AND '.join(conditions)} "
+        f"ORDER BY {order_by} LIMIT %s"
+    )
+    with conn.cursor() as db_cursor:
+        db_cursor.execute(sql, params + [limit])
+        return db_cursor.fetchall()
+
+def list_applications(conn, page_size=DEFAULT_PAGE_SIZE, cursor=None, housing_location=None,
+                      created_from=None, created_to=None):
+    """Return (applications, next_cursor) for one page; next_cursor is None on the last page"""
+    created_at = participant_id = None
+    if cursor:
+        created_at, participant_id = decode_cursor(cursor)
+    conditions = []
+    params = []
+    if created_from:
+        conditions.append("created_at >= %s")
+        params.append(_parse_datetime(created_from, 'createdFrom'))
+    if created_to:
+        conditions.append("created_at < %s")
+        params.append(_parse_datetime(created_to, 'createdTo'))
+    if housing_location:
+        conditions.append("housing_location = %s")
+        params.append(housing_location)
+
+    # One extra row tells us whether there is another page without a COUNT
+    limit = page_size + 1
+    rows = []
+    if created_at is not None or not cursor:
+        dated_conditions = conditions + ["created_at IS NOT NULL"]
+        dated_params = list(params)
+        if cursor:
+            # Written so the created_at bound is an index condition and the id tie-break a filter
+            dated_conditions.append("created_at <= %s AND (created_at < %s OR id < %s)")
+            dated_params.extend([created_at, created_at, participant_id])
+        rows = _fetch(conn, dated_conditions, dated_params, "created_at DESC, id DESC", limit)
+    if len(rows) < limit and not created_from and not created_to:
+        # Past the last dated participant: the undated ones, by id
+        undated_conditions = conditions + ["created_at IS NULL"]
+        undated_params = list(params)
+        if cursor and created_at is None:
+            undated_conditions.append("id < %s")
+            undated_params.append(participant_id)
+        rows += _fetch(conn, undated_conditions, undated_params, "id DESC", limit - len(rows))
+
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    applications = [
+        {
+            column: value.isoformat() if isinstance(value, (date, datetime)) else value
+            for column, value in zip(LIST_COLUMNS, row)
+        }
+        for row in rows
+    ]
+    next_cursor = encode_cursor(rows[-1][LIST_COLUMNS.index('created_at')], rows[-1][0]) if has_more else None
+    return applications, next_cursor
@@ -0,0 +1,18 @@
+import os
+
+import psycopg2
+
+_connection = None
+
+def connect():
+    """Open a connection to the participants database configured by DATABASE_URL"""
+    return psycopg2.connect(os.environ['DATABASE_URL'])
+
+def get_connection():
+    """Connection shared by invocations on this worker, reopened if the last one was closed"""
+    global _connection
+    if _connection is None or _connection.closed:
+        _connection = connect()
+        # Every statement here is a single read, so there's no transaction to hold open
+        _connection.autocommit = True
+    return _connection
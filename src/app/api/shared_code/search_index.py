@@ -0,0 +1,431 @@
+"""In-memory typeahead index over participant names, emails and phone numbers.
+
+Each distinct token (first name, last name, email local part, phone digits)
+keeps the sort keys of the participants that have it, in order, and is itself
+indexed under its trigrams and its first one to three characters. A query term
+finds its matching tokens through those postings, and the terms' lists are
+joined in order with bisect, so a search reads about limit entries per list
+whether it matches ten participants or half the table. Prefix matches rank
+ahead of matches inside a token, each tier ordered by last and first name.
+
+The index is built once per worker from a single projection query over
+participants, then kept current by pulling rows changed since the last refresh
+through idx_participants_updated_at, and by dropping participants that no
+longer exist, found every
+REMOVAL_CHECK_INTERVAL_SECONDS by a background scan of the primary key.
+Until the first build finishes, searches go to the database instead and match
+exact emails and names through idx_participants_email and idx_participants_name.
+"""
+import bisect
+import itertools
+import logging
+import re
+import threading
+import time
+from datetime import timedelta
+
+from .db import connect
+
+DEFAULT_RESULT_LIMIT = 10
+MAX_RESULT_LIMIT = 50
+MAX_QUERY_LENGTH = 100
+MAX_QUERY_TERMS = 5
+# How stale the index may be before a search pulls in changed participants
+REFRESH_INTERVAL_SECONDS = 30
+# Refreshes re-read this far behind the newest updated_at seen, for rows whose
+# transaction started before that one but committed after it
+REFRESH_OVERLAP = timedelta(seconds=60)
+# How long a deleted participant may still be found
+REMOVAL_CHECK_INTERVAL_SECONDS = 300
+SNAPSHOT_FETCH_SIZE = 5000
+# Tokens are indexed under their first one to PREFIX_LENGTH characters as well as their trigrams
+PREFIX_LENGTH = 3
+# A shorter fragment found inside email addresses or phone numbers matches too many to be useful
+MIN_CONTACT_INFIX = 4
+
+_EMPTY = frozenset()
+
+SEARCH_COLUMNS = ('id', 'first_name', 'last_name', 'email', 'phone_number', 'created_at', 'updated_at')
+
+_non_digits = re.compile(r'\D')
+_phone_fragment = re.compile(r'[\d()+.\-]*\d[\d()+.\-]*')
+
+class ParticipantRecord:
+    __slots__ = (
+        'id', 'first_name', 'last_name', 'email', 'phone_number', 'created_at', 'updated_at', 'name_tokens',
+        'contact_tokens', 'sort_key'
+    )
+
+    def __init__(self, id, first_name, last_name, email, phone_number, created_at=None, updated_at=None):
+        self.id = str(id)
+        self.first_name = first_name or ''
+        self.last_name = last_name or ''
+        self.email = email or ''
+        self.phone_number = phone_number or ''
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.name_tokens = tuple(dict.fromkeys(t for t in (self.first_name.lower(), self.last_name.lower()) if t))
+        # The email domain is left out: a fragment of it would match nearly every address
+        contacts = (self.email.lower().split('@')[0], _non_digits.sub('', self.phone_number))
+        self.contact_tokens = tuple(dict.fromkeys(t for t in contacts if t and t not in self.name_tokens))
+        self.sort_key = (self.last_name.lower(), self.first_name.lower(), self.id)
+
+    def to_json(self):
+        return {
+            'id': self.id,
+            'firstName': self.first_name,
+            'lastName': self.last_name,
+            'email': self.email,
+            'phoneNumber': self.phone_number,
+        }
+
+def _grams(token):
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+def _prefixes(token):
+    return {token[:length] for length in range(1, PREFIX_LENGTH + 1)}
+
+def query_terms(query):
+    """Lower-cased terms of a query; runs of digits and phone punctuation become one term of just the digits"""
+    terms = []
+    for term in query.lower().split():
+        if _phone_fragment.fullmatch(term):
+            digits = _non_digits.sub('', term)
+            if terms and terms[-1].isdigit():
+                # "(555) 123" is one phone number
+                terms[-1] += digits
+                continue
+            term = digits
+        if term:
+            terms.append(term)
+    return terms[:MAX_QUERY_TERMS]
+
+def _seek(lists, key):
+    """The smallest sort key at or after key in any of lists, or None"""
+    best = None
+    for keys in lists:
+        position = bisect.bisect_left(keys, key)
+        if position < len(keys) and (best is None or keys[position] < best):
+            best = keys[position]
+    return best
+
+def _intersection(term_lists):
+    """Sort keys present in at least one list of every term, in order.
+
+    A leapfrog join: each term seeks to the largest key any term has reached, so
+    runs of keys only one term has are skipped with a bisect instead of read.
+    """
+    key = ()
+    agreed = 0
+    while True:
+        for lists in term_lists:
+            found = _seek(lists, key)
+            if found is None:
+                return
+            if found == key:
+                agreed += 1
+            else:
+                key = found
+                agreed = 1
+            if agreed == len(term_lists):
+                yield key
+                # The next possible key: sort keys are unique, and key + ('',) sorts right after key
+                key = key + ('',)
+                agreed = 0
+
+class ParticipantSearchIndex:
+    """Sorted posting lists per token, found through trigram and prefix postings; safe to share between threads"""
+
+    def __init__(self):
+        self._records = {}
+        # token -> sort keys of the records with that token, in order
+        self._token_keys = {}
+        # 'name' or 'contact' -> trigram or prefix -> tokens
+        self._grams = {'name': {}, 'contact': {}}
+        self._prefixes = {'name': {}, 'contact': {}}
+        self._lock = threading.RLock()
+        self.latest_updated_at = None
+
+    def __len__(self):
+        return len(self._records)
+
+    def _index_token(self, token, kind):
+        for gram in _grams(token):
+            self._grams[kind].setdefault(gram, set()).add(token)
+        for prefix in _prefixes(token):
+            self._prefixes[kind].setdefault(prefix, set()).add(token)
+
+    def _unindex_token(self, token):
+        for kind in ('name', 'contact'):
+            for postings, keys in ((self._grams[kind], _grams(token)), (self._prefixes[kind], _prefixes(token))):
+                for key in keys:
+                    tokens = postings.get(key)
+                    if tokens is not None:
+                        tokens.discard(token)
+                        if not tokens:
+                            del postings[key]
+
+    def _add(self, record, keep_order=True):
+        self._records[record.id] = record
+        for kind, tokens in (('name', record.name_tokens), ('contact', record.contact_tokens)):
+            for token in tokens:
+                keys = self._token_keys.get(token)
+                if keys is None:
+                    self._token_keys[token] = [record.sort_key]
+                elif keep_order:
+                    bisect.insort(keys, record.sort_key)
+                else:
+                    keys.append(record.sort_key)
+                self._index_token(token, kind)
+        if record.updated_at and (self.latest_updated_at is None or record.updated_at > self.latest_updated_at):
+            self.latest_updated_at = record.updated_at
+
+    def _discard(self, participant_id):
+        record = self._records.pop(str(participant_id), None)
+        if record is None:
+            return
+        for token in record.name_tokens + record.contact_tokens:
+            keys = self._token_keys[token]
+            position = bisect.bisect_left(keys, record.sort_key)
+            if position < len(keys) and keys[position] == record.sort_key:
+                del keys[position]
+            else:
+                # Still unsorted in the middle of extend()
+                keys.remove(record.sort_key)
+            if not keys:
+                del self._token_keys[token]
+                self._unindex_token(token)
+
+    def upsert(self, record):
+        with self._lock:
+            self._discard(record.id)
+            self._add(record)
+
+    def extend(self, records):
+        """Add many records at once, sorting each token's keys once at the end"""
+        with self._lock:
+            for record in records:
+                self._discard(record.id)
+                self._add(record, keep_order=False)
+            for keys in self._token_keys.values():
+                keys.sort()
+
+    def remove(self, participant_id):
+        with self._lock:
+            self._discard(participant_id)
+
+    def remove_missing(self, existing_ids, checked_at):
+        """Drop records not among existing_ids, a scan of participants that started at checked_at.
+
+        Records changed since then may be newer than the scan and are kept;
+        a record with no updated_at is not confirmed by any row and is dropped.
+        Returns how many were dropped.
+        """
+        with self._lock:
+            missing = [
+                record.id for record in self._records.values()
+                if record.id not in existing_ids and (record.updated_at is None or record.updated_at < checked_at)
+            ]
+            for participant_id in missing:
+                self._discard(participant_id)
+        return len(missing)
+
+    def _tokens(self, term, kind, infix):
+        """Tokens of kind starting with term, or with infix containing it anywhere"""
+        if len(term) <= PREFIX_LENGTH:
+            starting = self._prefixes[kind].get(term, _EMPTY)
+            if len(term) < 3 or not infix:
+                # Too short for a trigram, so only prefix matches count
+                return starting
+        postings = sorted((self._grams[kind].get(gram, _EMPTY) for gram in _grams(term)), key=len)
+        tokens = postings[0]
+        for other in postings[1:]:
+            if not tokens:
+                break
+            tokens = tokens & other
+        return {token for token in tokens if (term in token if infix else token.startswith(term))}
+
+    def _term_lists(self, term, contacts, infix):
+        # An address is looked up by its local part and checked in full afterwards
+        term = term.split('@')[0]
+        lists = [self._token_keys[token] for token in self._tokens(term, 'name', infix)]
+        if contacts and len(term) >= (MIN_CONTACT_INFIX if infix else 3):
+            contact_lists = [self._token_keys[token] for token in self._tokens(term, 'contact', infix)]
+            # Contact tokens mostly belong to one participant each, so merge them into a single list
+            if contact_lists:
+                lists.append(sorted(itertools.chain.from_iterable(contact_lists)))
+        return lists
+
+    def search(self, query, limit=DEFAULT_RESULT_LIMIT):
+        """Records matching every term of query: prefix matches first, then by last and first name.
+
+        Prefix matches on names come first, then on emails and phone numbers,
+        then matches inside names and inside emails and phone numbers, stopping
+        as soon as limit are found. The common typeahead query is answered from
+        the names and never touches the many single-participant contact tokens.
+        """
+        terms = query_terms(query)
+        if not terms:
+            return []
+        emails = [term for term in terms if '@' in term]
+        found = []
+        seen = set()
+        with self._lock:
+            for contacts, infix in ((False, False), (True, False), (False, True), (True, True)):
+                term_lists = [self._term_lists(term, contacts, infix) for term in terms]
+                if not all(term_lists):
+                    continue
+                for sort_key in _intersection(term_lists):
+                    record = self._records[sort_key[-1]]
+                    if record.id in seen or not all(record.email.lower().startswith(term) for term in emails):
+                        continue
+                    seen.add(record.id)
+                    found.append(record)
+                    if len(found) == limit:
+                        return found
+        return found
+
+def _record(row):
+    return ParticipantRecord(*row)
+
+def load_snapshot(conn, index):
+    """Fill index with every participant, streamed through a server-side cursor"""
+    with conn.cursor(name='participant_search_snapshot') as cursor:
+        cursor.itersize = SNAPSHOT_FETCH_SIZE
+        cursor.execute(f"SELECT {', '.join(SEARCH_COLUMNS)} FROM participants")
+        index.extend(map(_record, cursor))
+
+def load_changed_since(conn, index):
+    """Upsert participants changed since the newest one in index; a range scan on idx_participants_updated_at"""
+    sql = f"SELECT {', '.join(SEARCH_COLUMNS)} FROM participants"
+    with conn.cursor() as cursor:
+        if index.latest_updated_at is None:
+            cursor.execute(sql)
+        else:
+            cursor.execute(f"{sql} WHERE updated_at > %s", (index.latest_updated_at - REFRESH_OVERLAP,))
+        rows = cursor.fetchall()
+    for row in rows:
+        index.upsert(_record(row))
+    return len(rows)
+
+def load_existing_ids(conn):
+    """(ids of every participant, database time the scan started); an index-only scan of the primary key"""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT now()")
+        checked_at = cursor.fetchone()[0]
+    with conn.cursor(name='participant_search_ids') as cursor:
+        cursor.itersize = SNAPSHOT_FETCH_SIZE
+        cursor.execute("SELECT id FROM participants")
+        existing_ids = {str(row[0]) for row in cursor}
+    return existing_ids, checked_at
+
+def search_database(conn, query, limit=DEFAULT_RESULT_LIMIT):
+    """Exact email or name lookups for use before the index is built"""
+    terms = query.split()
+    if not terms:
+        return []
+    if len(terms) == 1 and '@' in terms[0]:
+        condition, params = "email = %s", [terms[0].lower()]
+    elif len(terms) == 1:
+        # last_name alone is not a leading column of idx_participants_name, so one word is a first name
+        condition, params = "first_name = %s", [terms[0].capitalize()]
+    else:
+        condition, params = "first_name = %s AND last_name = %s", [terms[0].capitalize(), terms[-1].capitalize()]
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"SELECT {', '.join(SEARCH_COLUMNS)} FROM participants WHERE {condition} "
+            f"ORDER BY last_name, first_name LIMIT %s",
+            params + [limit]
+        )
+        return [_record(row) for row in cursor.fetchall()]
+
+class SearchService:
+    """Owns the worker's index: builds it in the background and keeps it refreshed"""
+
+    def __init__(self, connect):
+        self.connect = connect
+        self.index = ParticipantSearchIndex()
+        self.ready = threading.Event()
+        self._build_started = False
+        self._refreshed_at = 0.0
+        self._removals_checked_at = 0.0
+        self._removal_check_running = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._build_started:
+                return
+            self._build_started = True
+        threading.Thread(target=self._build, name='participant-search-build', daemon=True).start()
+
+    def _build(self):
+        started = time.perf_counter()
+        try:
+            # A connection of its own, so searches keep the shared one while the snapshot streams
+            conn = self.connect()
+            try:
+                index = ParticipantSearchIndex()
+                load_snapshot(conn, index)
+            finally:
+                conn.close()
+        except Exception as e:
+            logging.error(f"Building the participant search index failed: {str(e)}")
+            with self._lock:
+                self._build_started = False
+            return
+        with self._lock:
+            self.index = index
+            # Rows committed while the snapshot streamed come in with the first refresh
+            self._refreshed_at = 0.0
+            self._removals_checked_at = time.monotonic()
+            self.ready.set()
+        logging.info(f"Indexed {len(self.index)} participants for search in {time.perf_counter() - started:.2f}s")
+
+    def _remove_deleted(self):
+        try:
+            # A connection of its own, like the build, so searches are not held up by the scan
+            conn = self.connect()
+            try:
+                existing_ids, checked_at = load_existing_ids(conn)
+            finally:
+                conn.close()
+            removed = self.index.remove_missing(existing_ids, checked_at)
+            if removed:
+                logging.info(f"Removed {removed} deleted participants from the search index")
+        except Exception as e:
+            logging.warning(f"Checking the participant search index for deletions failed: {str(e)}")
+        finally:
+            with self._lock:
+                self._removal_check_running = False
+
+    def search(self, conn, query, limit=DEFAULT_RESULT_LIMIT):
+        self.start()
+        if not self.ready.is_set():
+            return search_database(conn, query, limit)
+        if time.monotonic() - self._refreshed_at > REFRESH_INTERVAL_SECONDS:
+            self._refreshed_at = time.monotonic()
+            try:
+                load_changed_since(conn, self.index)
+            except Exception as e:
+                logging.warning(f"Refreshing the participant search index failed: {str(e)}")
+        with self._lock:
+            check_removals = (
+                not self._removal_check_running
+                and time.monotonic() - self._removals_checked_at > REMOVAL_CHECK_INTERVAL_SECONDS
+            )
+            if check_removals:
+                self._removal_check_running = True
+                self._removals_checked_at = time.monotonic()
+        if check_removals:
+            threading.Thread(target=self._remove_deleted, name='participant-search-removals', daemon=True).start()
+        return self.index.search(query, limit)
+
+_service = None
+
+def get_search_service():
+    """The worker's search service, building its index on first use"""
+    global _service
+    if _service is None:
+        _service = SearchService(connect)
+    return _service